@@ -1,20 +1,34 @@
 # app.py
 import os
+import gzip
+import json
+import asyncio
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from uuid import uuid4
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone, MINYEAR, MAXYEAR
 from typing import Optional, List, Literal, Tuple
 
 from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, FileResponse
+from starlette.datastructures import Headers, MutableHeaders
 from pydantic import BaseModel, EmailStr, Field
 
 from sqlalchemy import (
     create_engine, String, DateTime, Date, Boolean, Float, Integer,
-    select, func, or_, and_, update, event, UniqueConstraint, ForeignKey,
+    select, func, or_, and_, update, delete, event, UniqueConstraint, ForeignKey,
     literal,  # <-- necesario para COALESCE con 0
+    inspect, text,
 )
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session, sessionmaker
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session, sessionmaker, validates
 from sqlalchemy.exc import IntegrityError
 
 from dotenv import load_dotenv
@@ -23,6 +37,11 @@ from dotenv import load_dotenv
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 
+try:  # brotli es opcional: sin él solo se negocia gzip
+    import brotli
+except ImportError:
+    brotli = None
+
 # --- carga env ---
 load_dotenv()
 
@@ -60,6 +79,9 @@ class Base(DeclarativeBase):
 
 
 # --------------------------- MODELOS ORM ---------------------------
+def _norm(value: str) -> str:
+    return value.strip().lower()
+
 class UserORM(Base):
     __tablename__ = "users"
     __table_args__ = (UniqueConstraint("email"), UniqueConstraint("username"))
@@ -71,6 +93,21 @@ class UserORM(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     password_hash: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
 
+    # copias normalizadas (minúsculas) con índice único: las búsquedas case-insensitive
+    # usan índice en vez de func.lower() sobre toda la tabla
+    email_norm: Mapped[str] = mapped_column(String(255), unique=True, index=True, nullable=False)
+    username_norm: Mapped[str] = mapped_column(String(30), unique=True, index=True, nullable=False)
+
+    @validates("email")
+    def _set_email_norm(self, key, value):
+        self.email_norm = _norm(value)
+        return value
+
+    @validates("username")
+    def _set_username_norm(self, key, value):
+        self.username_norm = _norm(value)
+        return value
+
 class PointsORM(Base):
     __tablename__ = "points"
     user_id: Mapped[str] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
@@ -109,9 +146,13 @@ class ActivityORM(Base):
     place_lon: Mapped[Optional[float]] = mapped_column(Float)
     radius_m: Mapped[int] = mapped_column(Integer, nullable=False, default=150)
 
-    # fecha objetivo (para mostrar en "Hoy")
+    # fecha objetivo (para mostrar en "Hoy"); en recurrentes es el DTSTART de la regla
     due_date: Mapped[Optional[date]] = mapped_column(Date, index=True)
 
+    # regla de recurrencia estilo RRULE (FREQ=DAILY;INTERVAL=1;...). Se expande al vuelo,
+    # no se materializa una fila por ocurrencia.
+    rrule: Mapped[Optional[str]] = mapped_column(String(200))
+
     # puntos a dar al completar
     points_on_complete: Mapped[int] = mapped_column(Integer, nullable=False, default=5)
 
@@ -122,6 +163,40 @@ class ActivityORM(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
+# --------- NUEVO: Completados de actividades recurrentes (una fila por ocurrencia hecha) ----------
+class ActivityCompletionORM(Base):
+    __tablename__ = "activity_completions"
+    __table_args__ = (UniqueConstraint("activity_id", "occurrence_date"),)
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid4()))
+    activity_id: Mapped[str] = mapped_column(String(36), ForeignKey("activities.id", ondelete="CASCADE"), nullable=False)
+    user_id: Mapped[str] = mapped_column(String(36), ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
+    occurrence_date: Mapped[date] = mapped_column(Date, nullable=False)
+    done_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+# --------- NUEVO: Outbox (efectos secundarios, se escriben en la misma transacción) ----------
+class OutboxORM(Base):
+    __tablename__ = "outbox"
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid4()))
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)       # points.grant/points.ensure_row/...
+    payload: Mapped[str] = mapped_column(String(2000), nullable=False)  # JSON
+    user_id: Mapped[Optional[str]] = mapped_column(String(36), index=True)  # copia de payload["user_id"], si lo hay
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    available_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, index=True, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(String(500))
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), index=True)
+
+# --------- NUEVO: Borrado de usuarios por lotes (sin FK: sobrevive al borrado del usuario) ----------
+class UserPurgeORM(Base):
+    __tablename__ = "user_purges"
+    user_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending")  # pending/running/done
+    current_table: Mapped[Optional[str]] = mapped_column(String(50))
+    deleted_rows: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+
 
 # --------------------------- Pydantic ---------------------------
 username_regex = r"^[a-zA-Z0-9._-]{3,30}$"
@@ -164,6 +239,7 @@ class PointsOut(BaseModel):
     user_id: str
     total: int
     updated_at: datetime
+    pending: int = 0  # puntos ya concedidos pero aún en el outbox (no incluidos en total)
     class Config:
         from_attributes = True
 
@@ -185,6 +261,17 @@ class FriendRequestCreate(BaseModel):
     to_user_id: Optional[str] = None
     to_username: Optional[str] = None
 
+class PurgeStatus(BaseModel):
+    user_id: str
+    status: Literal["pending", "running", "done"]
+    current_table: Optional[str] = None
+    deleted_rows: int
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
 class LeaderItem(BaseModel):
     user_id: str
     username: str
@@ -203,6 +290,7 @@ class ActivityBase(BaseModel):
     radius_m: Optional[int] = Field(150, ge=25, le=5000)
     due_date: Optional[date] = None
     points_on_complete: Optional[int] = Field(5, ge=0, le=100000)
+    rrule: Optional[str] = Field(None, max_length=200)  # p.ej. FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10
 
 class ActivityCreate(ActivityBase):
     pass
@@ -218,6 +306,7 @@ class ActivityUpdate(BaseModel):
     radius_m: Optional[int] = Field(None, ge=25, le=5000)
     due_date: Optional[date] = None
     points_on_complete: Optional[int] = Field(None, ge=0, le=100000)
+    rrule: Optional[str] = Field(None, max_length=200)  # "" para quitar la recurrencia
     is_done: Optional[bool] = None  # permitir marcar/desmarcar
 
 class ActivityOut(ActivityBase):
@@ -227,6 +316,8 @@ class ActivityOut(ActivityBase):
     done_at: Optional[datetime]
     created_at: datetime
     updated_at: datetime
+    occurrence_date: Optional[date] = None  # solo en ocurrencias expandidas de una recurrente
+    awarded_points: Optional[int] = None    # solo en /complete: puntos encolados (el total se actualiza en segundo plano)
     class Config:
         from_attributes = True
 
@@ -239,6 +330,7 @@ class CompletePayload(BaseModel):
     lon: Optional[float] = None
     verify_location: bool = True     # si la actividad tiene lugar, exigir lat/lon y estar dentro del radio
     points: Optional[int] = None     # si lo pasas, sobreescribe points_on_complete para esta finalización
+    occurrence_date: Optional[date] = None  # recurrentes: ocurrencia a completar (por defecto hoy)
 
 
 # --------------------------- Auth utils (PBKDF2) ---------------------------
@@ -271,8 +363,210 @@ def create_access_token(sub: str) -> str:
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
+# --------------------------- Outbox + worker ---------------------------
+# Los handlers escriben el cambio principal y encolan aquí sus efectos secundarios en el mismo
+# commit; el worker (en proceso o `python worker.py`) los aplica con reintentos y backoff.
+OUTBOX_INPROCESS = os.getenv("OUTBOX_INPROCESS", "1") != "0"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_S = float(os.getenv("OUTBOX_POLL_S", "1.0"))
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE_S = 2.0
+OUTBOX_BACKOFF_MAX_S = 300.0
+# retención: los eventos procesados se borran pasado este tiempo, por lotes; los muertos
+# (attempts >= OUTBOX_MAX_ATTEMPTS) se conservan para poder inspeccionarlos en /metrics/outbox
+OUTBOX_RETENTION_H = float(os.getenv("OUTBOX_RETENTION_H", "24"))
+OUTBOX_PRUNE_BATCH = 1000
+OUTBOX_PRUNE_EVERY_S = 60.0
+
+# contadores del proceso actual (la profundidad de cola se lee de la BD)
+_outbox_stats = {"processed": 0, "failed": 0, "pruned": 0, "last_batch_at": None, "last_lag_s": None}
+
+def _naive_utc(ts: datetime) -> datetime:
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+def _enqueue(db: Session, kind: str, *, delay_s: float = 0.0, **payload) -> None:
+    """Añade un evento a la sesión actual; se persiste con el commit del handler."""
+    db.add(OutboxORM(
+        kind=kind,
+        payload=json.dumps(payload),
+        user_id=payload.get("user_id"),
+        available_at=datetime.utcnow() + timedelta(seconds=delay_s),
+    ))
+
+def _outbox_ensure_points_row(db: Session, p: dict) -> None:
+    if db.get(UserORM, p["user_id"]) and not db.get(PointsORM, p["user_id"]):
+        db.add(PointsORM(user_id=p["user_id"], total=0))
+        db.flush()
+
+def _pending_points(db: Session, user_id: str) -> int:
+    """Puntos encolados para el usuario que el worker aún no ha sumado (sin contar los muertos)."""
+    payloads = db.scalars(select(OutboxORM.payload).where(
+        OutboxORM.user_id == user_id,
+        OutboxORM.kind == "points.grant",
+        OutboxORM.processed_at.is_(None),
+        OutboxORM.attempts < OUTBOX_MAX_ATTEMPTS,
+    )).all()
+    return sum(int(json.loads(p)["amount"]) for p in payloads)
+
+def _outbox_grant_points(db: Session, p: dict) -> None:
+    if not db.get(UserORM, p["user_id"]):
+        return  # usuario borrado antes de procesar el evento
+    _outbox_ensure_points_row(db, p)
+    db.execute(
+        update(PointsORM)
+        .where(PointsORM.user_id == p["user_id"])
+        .values(total=PointsORM.total + int(p["amount"]))
+    )
+
+# Purga de usuarios: cada evento borra como mucho PURGE_CHUNK_SIZE filas y se vuelve a encolar,
+# así ninguna transacción bloquea la BD (en SQLite, entera) durante todo el borrado.
+PURGE_CHUNK_SIZE = int(os.getenv("PURGE_CHUNK_SIZE", "200"))
+PURGE_CHUNK_PAUSE_S = float(os.getenv("PURGE_CHUNK_PAUSE_S", "0.05"))
+
+def _purge_steps(uid: str):
+    return [
+        (ActivityCompletionORM, ActivityCompletionORM.user_id == uid),
+        (ActivityORM, ActivityORM.user_id == uid),
+        (FriendORM, or_(FriendORM.user_a_id == uid, FriendORM.user_b_id == uid, FriendORM.requested_by_id == uid)),
+    ]
+
+def _outbox_purge_user(db: Session, p: dict) -> None:
+    uid = p["user_id"]
+    job = db.get(UserPurgeORM, uid)
+    if not job or job.status == "done":
+        return
+    job.status = "running"
+    for model, cond in _purge_steps(uid):
+        chunk = select(model.id).where(cond).limit(PURGE_CHUNK_SIZE).scalar_subquery()
+        n = db.execute(delete(model).where(model.id.in_(chunk))).rowcount
+        if n:
+            job.current_table = model.__tablename__
+            job.deleted_rows += n
+            _enqueue(db, "user.purge", delay_s=PURGE_CHUNK_PAUSE_S, user_id=uid)
+            return
+    # no quedan dependientes grandes: puntos y el propio usuario
+    job.deleted_rows += db.execute(delete(PointsORM).where(PointsORM.user_id == uid)).rowcount
+    job.deleted_rows += db.execute(delete(UserORM).where(UserORM.id == uid)).rowcount
+    job.status = "done"
+    job.current_table = None
+    job.finished_at = datetime.utcnow()
+
+# Los handlers no hacen commit: el efecto y la marca processed_at van en la misma transacción.
+OUTBOX_HANDLERS = {
+    "points.ensure_row": _outbox_ensure_points_row,
+    "points.grant": _outbox_grant_points,
+    "user.purge": _outbox_purge_user,
+}
+
+def _drain_outbox(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Procesa un lote de eventos pendientes. Devuelve cuántos se han intentado."""
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        if is_sqlite:
+            # tomar el lock de escritura desde el principio; una transacción diferida que lee y luego
+            # escribe se interbloquea con otros escritores ("database is locked")
+            db.execute(text("BEGIN IMMEDIATE"))
+        stmt = (
+            select(OutboxORM)
+            .where(
+                OutboxORM.processed_at.is_(None),
+                OutboxORM.attempts < OUTBOX_MAX_ATTEMPTS,
+                OutboxORM.available_at <= now,
+            )
+            .order_by(OutboxORM.available_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)  # varios workers en Postgres; SQLite lo ignora
+        )
+        events = db.scalars(stmt).all()
+        for ev in events:
+            try:
+                with db.begin_nested():
+                    OUTBOX_HANDLERS[ev.kind](db, json.loads(ev.payload))
+                ev.processed_at = datetime.utcnow()
+                _outbox_stats["processed"] += 1
+                _outbox_stats["last_lag_s"] = (ev.processed_at - _naive_utc(ev.created_at)).total_seconds()
+            except Exception as e:
+                ev.attempts += 1
+                ev.last_error = repr(e)[:500]
+                delay = min(OUTBOX_BACKOFF_BASE_S * 2 ** (ev.attempts - 1), OUTBOX_BACKOFF_MAX_S)
+                ev.available_at = datetime.utcnow() + timedelta(seconds=delay)
+                _outbox_stats["failed"] += 1
+                print("Outbox event failed:", ev.kind, ev.id, repr(e))
+        db.commit()
+    _outbox_stats["last_batch_at"] = now
+    return len(events)
+
+def _prune_outbox(batch_size: int = OUTBOX_PRUNE_BATCH) -> int:
+    """Borra un lote de eventos procesados más antiguos que OUTBOX_RETENTION_H. Devuelve cuántos."""
+    cutoff = datetime.utcnow() - timedelta(hours=OUTBOX_RETENTION_H)
+    with SessionLocal() as db:
+        old = (
+            select(OutboxORM.id)
+            .where(OutboxORM.processed_at.is_not(None), OutboxORM.processed_at < cutoff)
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        n = db.execute(delete(OutboxORM).where(OutboxORM.id.in_(old))).rowcount
+        db.commit()
+    _outbox_stats["pruned"] += n
+    return n
+
+def _outbox_next_due_s() -> float:
+    """Segundos hasta el próximo evento pendiente (OUTBOX_POLL_S si no hay ninguno)."""
+    with SessionLocal() as db:
+        nxt = db.scalar(select(func.min(OutboxORM.available_at)).where(
+            OutboxORM.processed_at.is_(None), OutboxORM.attempts < OUTBOX_MAX_ATTEMPTS,
+        ))
+    if nxt is None:
+        return OUTBOX_POLL_S
+    return min(max((_naive_utc(nxt) - datetime.utcnow()).total_seconds(), 0.0), OUTBOX_POLL_S)
+
+async def run_outbox_worker(stop: asyncio.Event) -> None:
+    next_prune = 0.0
+    while not stop.is_set():
+        try:
+            n = await asyncio.to_thread(_drain_outbox)
+            if time.monotonic() >= next_prune:
+                # lote lleno: queda más por borrar, se sigue en la próxima vuelta
+                full = await asyncio.to_thread(_prune_outbox) >= OUTBOX_PRUNE_BATCH
+                next_prune = time.monotonic() + (0.0 if full else OUTBOX_PRUNE_EVERY_S)
+            # lote incompleto: dormir hasta el siguiente evento (p.ej. el próximo trozo de una
+            # purga, PURGE_CHUNK_PAUSE_S) o, como mucho, hasta el siguiente sondeo
+            wait_s = 0.0 if n >= OUTBOX_BATCH_SIZE else await asyncio.to_thread(_outbox_next_due_s)
+        except Exception as e:
+            print("Outbox worker error:", repr(e))
+            wait_s = OUTBOX_POLL_S
+        if wait_s > 0:
+            try:
+                await asyncio.wait_for(stop.wait(), wait_s)
+            except asyncio.TimeoutError:
+                pass
+
+def outbox_metrics(db: Session) -> dict:
+    pending = OutboxORM.processed_at.is_(None)
+    depth = db.scalar(select(func.count()).select_from(OutboxORM).where(pending, OutboxORM.attempts < OUTBOX_MAX_ATTEMPTS))
+    dead = db.scalar(select(func.count()).select_from(OutboxORM).where(pending, OutboxORM.attempts >= OUTBOX_MAX_ATTEMPTS))
+    oldest = db.scalar(select(func.min(OutboxORM.created_at)).where(pending, OutboxORM.attempts < OUTBOX_MAX_ATTEMPTS))
+    return {
+        "queue_depth": depth,
+        "dead": dead,
+        "oldest_pending_age_s": (datetime.utcnow() - _naive_utc(oldest)).total_seconds() if oldest else 0.0,
+        "worker_inprocess": OUTBOX_INPROCESS,
+        **_outbox_stats,
+    }
+
+
 # --------------------------- FastAPI ---------------------------
-app = FastAPI(title="DailyCulture API (local)", version="1.1.0")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    stop = asyncio.Event()
+    task = asyncio.create_task(run_outbox_worker(stop)) if OUTBOX_INPROCESS else None
+    yield
+    stop.set()
+    if task:
+        await task
+
+app = FastAPI(title="DailyCulture API (local)", version="1.1.0", lifespan=lifespan)
 
 # CORS para local dev (Flutter, web, etc.)
 allowed = os.getenv("CORS_ORIGINS", "http://localhost, http://localhost:3000, http://127.0.0.1").split(",")
@@ -284,6 +578,75 @@ app.add_middleware(
     allow_credentials=True,
 )
 
+# Compresión negociada (br > gzip) de respuestas de texto/JSON a partir de un tamaño mínimo.
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+_COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+def _pick_encoding(accept: str) -> Optional[str]:
+    """Elige br/gzip según Accept-Encoding respetando q-values (q=0 = no aceptable)."""
+    q = {}
+    for token in accept.lower().split(","):
+        name, *params = [part.strip() for part in token.split(";")]
+        if not name:
+            continue
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        q[name] = weight
+    candidates = (["br"] if brotli else []) + ["gzip"]
+    scored = [(q.get(c, q.get("*", 0.0)), -i, c) for i, c in enumerate(candidates)]
+    weight, _, best = max(scored)
+    return best if weight > 0 else None
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = _pick_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+
+        async def _send(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if start is None:  # cabeceras ya enviadas: pasar tal cual
+                return await send(message)
+            pending, start = start, None
+            headers = MutableHeaders(raw=pending["headers"])
+            body = message.get("body", b"")
+            if (
+                message["type"] != "http.response.body"
+                or message.get("more_body")          # streaming / ficheros: no se toca
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not headers.get("content-type", "").startswith(_COMPRESSIBLE_TYPES)
+            ):
+                await send(pending)
+                return await send(message)
+            body = brotli.compress(body, quality=4) if encoding == "br" else gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(pending)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, _send)
+
+app.add_middleware(CompressionMiddleware)
+
 security = HTTPBearer()
 
 def get_db():
@@ -310,17 +673,19 @@ def get_current_user(
     user = db.get(UserORM, user_id)
     if not user:
         raise HTTPException(status_code=401, detail="Usuario no encontrado")
+    if not user.is_active:
+        raise HTTPException(status_code=403, detail="Usuario desactivado")
     return user
 
 def _ensure_unique(db: Session, email: str, username: str, exclude_id: Optional[str] = None):
-    q = select(UserORM).where(or_(func.lower(UserORM.email) == email.lower(),
-                                  func.lower(UserORM.username) == username.lower()))
+    email, username = _norm(email), _norm(username)
+    q = select(UserORM).where(or_(UserORM.email_norm == email, UserORM.username_norm == username))
     for u in db.scalars(q).all():
         if exclude_id and u.id == exclude_id:
             continue
-        if u.email.lower() == email.lower():
+        if u.email_norm == email:
             raise HTTPException(status_code=409, detail="Email ya está en uso")
-        if u.username.lower() == username.lower():
+        if u.username_norm == username:
             raise HTTPException(status_code=409, detail="Username ya está en uso")
 
 def _ensure_points_row(db: Session, user_id: str) -> PointsORM:
@@ -344,6 +709,23 @@ def _add_points(db: Session, user_id: str, amount: int) -> PointsORM:
     db.commit()
     return db.get(PointsORM, user_id)
 
+# Proyección ?fields=a,b,c: el SELECT solo pide esas columnas y la respuesta solo las incluye.
+def _parse_fields(fields: Optional[str], model: type) -> Optional[List[str]]:
+    if not fields:
+        return None
+    wanted = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in wanted if f not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(unknown)}")
+    return wanted
+
+def _columns(orm: type, names) -> list:
+    return [getattr(orm, n) for n in names if n in orm.__table__.columns]
+
+def _fields_response(items: List[BaseModel], wanted: List[str]) -> JSONResponse:
+    # respuesta parcial: no puede validarse contra el response_model completo
+    return JSONResponse(jsonable_encoder([x.model_dump(include=set(wanted)) for x in items]))
+
 def _pair_key(a: str, b: str) -> Tuple[str, str, str]:
     aa, bb = sorted([a, b])
     return aa, bb, f"{aa}:{bb}"
@@ -360,6 +742,118 @@ def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     a = 0.5 - cos((lat2 - lat1) * p) / 2 + cos(lat1 * p) * cos(lat2 * p) * (1 - cos((lon2 - lon1) * p)) / 2
     return 12742000 * asin(sqrt(a))
 
+# RRULE (subconjunto): FREQ=DAILY|WEEKLY|MONTHLY, INTERVAL, BYDAY (solo WEEKLY), COUNT, UNTIL=YYYYMMDD.
+# DTSTART es el due_date de la actividad.
+_RRULE_WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+RRULE_MAX_COUNT = 1000
+RECURRENCE_WINDOW_DAYS = 30  # ventana por defecto al expandir sin due_from/due_to
+RECURRENCE_MAX_WINDOW_DAYS = 366  # tope de la ventana de expansión aunque due_from/due_to pidan más
+
+def _parse_rrule(raw: str) -> dict:
+    parts = {}
+    for chunk in raw.strip().upper().removeprefix("RRULE:").split(";"):
+        if not chunk:
+            continue
+        key, sep, value = chunk.partition("=")
+        if not sep or not value:
+            raise ValueError(f"Parte inválida: {chunk}")
+        parts[key] = value
+
+    freq = parts.pop("FREQ", None)
+    if freq not in ("DAILY", "WEEKLY", "MONTHLY"):
+        raise ValueError("FREQ debe ser DAILY, WEEKLY o MONTHLY")
+    rule = {"freq": freq, "interval": 1, "byday": None, "count": None, "until": None}
+
+    if "INTERVAL" in parts:
+        rule["interval"] = int(parts.pop("INTERVAL"))
+        if not 1 <= rule["interval"] <= 366:
+            raise ValueError("INTERVAL fuera de rango")
+    if "BYDAY" in parts:
+        if freq != "WEEKLY":
+            raise ValueError("BYDAY solo se admite con FREQ=WEEKLY")
+        days = parts.pop("BYDAY").split(",")
+        if any(d not in _RRULE_WEEKDAYS for d in days):
+            raise ValueError("BYDAY inválido")
+        rule["byday"] = sorted({_RRULE_WEEKDAYS[d] for d in days})
+    if "COUNT" in parts:
+        rule["count"] = int(parts.pop("COUNT"))
+        if not 1 <= rule["count"] <= RRULE_MAX_COUNT:
+            raise ValueError(f"COUNT debe estar entre 1 y {RRULE_MAX_COUNT}")
+    if "UNTIL" in parts:
+        rule["until"] = datetime.strptime(parts.pop("UNTIL")[:8], "%Y%m%d").date()
+    if rule["count"] is not None and rule["until"] is not None:
+        raise ValueError("COUNT y UNTIL son excluyentes")
+    if parts:
+        raise ValueError(f"Partes no soportadas: {', '.join(sorted(parts))}")
+    return rule
+
+def _shift_days(d: date, days: int) -> date:
+    """d + days, recortado a [date.min, date.max] en vez de lanzar OverflowError."""
+    try:
+        return d + timedelta(days=days)
+    except OverflowError:
+        return date.max if days > 0 else date.min
+
+def _add_months(d: date, months: int) -> Optional[date]:
+    y, m = divmod(d.month - 1 + months, 12)
+    if not MINYEAR <= d.year + y <= MAXYEAR:
+        raise OverflowError("date value out of range")
+    try:
+        return d.replace(year=d.year + y, month=m + 1)
+    except ValueError:
+        return None  # p.ej. día 31 en un mes de 30: esa ocurrencia no existe (RFC 5545)
+
+def _expand_rrule(rule: dict, dtstart: date, start: date, end: date, limit: Optional[int] = None) -> List[date]:
+    """Ocurrencias de la regla dentro de [start, end] (como mucho `limit`), sin generar las anteriores salvo con COUNT."""
+    if rule["until"] is not None:
+        end = min(end, rule["until"])
+    if end < start or end < dtstart:
+        return []
+    interval = rule["interval"]
+    # Con COUNT hay que contar desde DTSTART; sin COUNT saltamos directamente a la ventana.
+    skip = rule["count"] is None and start > dtstart
+    out: List[date] = []
+    emitted = 0
+
+    def _take(d: date) -> bool:
+        nonlocal emitted
+        if d < dtstart:
+            return True
+        if d > end or (rule["count"] is not None and emitted >= rule["count"]):
+            return False
+        emitted += 1
+        if d >= start:
+            out.append(d)
+        return limit is None or len(out) < limit
+
+    try:
+        if rule["freq"] == "DAILY":
+            k = (start - dtstart).days // interval if skip else 0
+            while _take(dtstart + timedelta(days=k * interval)):
+                k += 1
+        elif rule["freq"] == "WEEKLY":
+            week0 = dtstart - timedelta(days=dtstart.weekday())
+            days = rule["byday"] or [dtstart.weekday()]
+            k = (start - week0).days // 7 // interval if skip else 0
+            while True:
+                week = week0 + timedelta(weeks=k * interval)
+                if not all(_take(week + timedelta(days=wd)) for wd in days):
+                    break
+                k += 1
+        else:  # MONTHLY
+            k = ((start.year - dtstart.year) * 12 + start.month - dtstart.month) // interval if skip else 0
+            while True:
+                d = _add_months(dtstart, k * interval)
+                if d is None:
+                    if _add_months(dtstart.replace(day=1), k * interval) > end:
+                        break
+                elif not _take(d):
+                    break
+                k += 1
+    except OverflowError:
+        pass  # la serie llega al final del calendario (año 9999)
+    return out
+
 
 # --------------------------- Rutas ---------------------------
 @app.get("/")
@@ -376,21 +870,45 @@ def health():
         "hash_scheme": "pbkdf2_sha256",
     }
 
+@app.get("/metrics/outbox")
+def outbox_stats(db: Session = Depends(get_db)):
+    return outbox_metrics(db)
+
 
 # --------------------------- Users CRUD ---------------------------
 @app.get("/users", response_model=List[User])
-def list_users(q: Optional[str] = Query(None), limit: int = 50, offset: int = 0, db: Session = Depends(get_db)):
-    stmt = select(UserORM).order_by(UserORM.created_at.desc())
+def list_users(
+    q: Optional[str] = Query(None),
+    limit: int = 50,
+    offset: int = 0,
+    fields: Optional[str] = Query(None, description="Campos a devolver, p.ej. id,username"),
+    db: Session = Depends(get_db),
+):
+    wanted = _parse_fields(fields, User)
+    stmt = select(*_columns(UserORM, wanted)) if wanted else select(UserORM)
+    stmt = stmt.order_by(UserORM.created_at.desc())
     if q:
         like = f"%{q.lower()}%"
         stmt = stmt.where(
             or_(
-                func.lower(UserORM.email).like(like),
-                func.lower(UserORM.username).like(like),
+                UserORM.email_norm.like(like),
+                UserORM.username_norm.like(like),
                 func.lower(func.coalesce(UserORM.full_name, "")).like(like),
             )
         )
-    return [User.model_validate(u) for u in db.scalars(stmt.offset(offset).limit(limit)).all()]
+    stmt = stmt.offset(offset).limit(limit)
+    if wanted:
+        return _fields_response([User.model_construct(**r) for r in db.execute(stmt).mappings()], wanted)
+    return [User.model_validate(u) for u in db.scalars(stmt).all()]
+
+# Validación en vivo del alta. Es una sola búsqueda en el índice único de username_norm
+# (O(log n), sin escanear la tabla) y siempre al día con todos los procesos e instancias;
+# un filtro en memoria por proceso no lo estaría y no ahorra nada que merezca la pena.
+@app.get("/users/available")
+def username_available(username: str = Query(..., pattern=username_regex), db: Session = Depends(get_db)):
+    name = _norm(username)
+    taken = db.scalar(select(UserORM.id).where(UserORM.username_norm == name)) is not None
+    return {"username": username, "available": not taken}
 
 @app.get("/users/{user_id}", response_model=User)
 def get_user(user_id: str, db: Session = Depends(get_db)):
@@ -411,12 +929,13 @@ def create_user(data: UserCreate, db: Session = Depends(get_db)):
             password_hash=hash_password(data.password),
         )
         db.add(u)
+        db.flush()
+
+        # la fila de puntos la crea el worker (get_my_points también la asegura)
+        _enqueue(db, "points.ensure_row", user_id=u.id)
         db.commit()
         db.refresh(u)
 
-        # crear fila de puntos al vuelo
-        _ensure_points_row(db, u.id)
-
         return User.model_validate(u)
     except IntegrityError:
         db.rollback()
@@ -427,6 +946,8 @@ def replace_user(user_id: str, data: UserCreate, db: Session = Depends(get_db)):
     u = db.get(UserORM, user_id)
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    if db.get(UserPurgeORM, user_id):
+        raise HTTPException(status_code=409, detail="Usuario en proceso de borrado")
     _ensure_unique(db, data.email, data.username, exclude_id=user_id)
     try:
         u.email = data.email
@@ -446,6 +967,8 @@ def update_user(user_id: str, data: UserUpdate, db: Session = Depends(get_db)):
     u = db.get(UserORM, user_id)
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    if db.get(UserPurgeORM, user_id):
+        raise HTTPException(status_code=409, detail="Usuario en proceso de borrado")
     _ensure_unique(db, data.email or u.email, data.username or u.username, exclude_id=user_id)
     if data.email is not None:
         u.email = data.email
@@ -459,24 +982,41 @@ def update_user(user_id: str, data: UserUpdate, db: Session = Depends(get_db)):
     db.refresh(u)
     return User.model_validate(u)
 
-@app.delete("/users/{user_id}", status_code=204)
+@app.delete("/users/{user_id}", status_code=202, response_model=PurgeStatus)
 def delete_user(user_id: str, db: Session = Depends(get_db)):
+    job = db.get(UserPurgeORM, user_id)
+    if job:
+        return PurgeStatus.model_validate(job)
     u = db.get(UserORM, user_id)
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    db.delete(u)
+    # desactivar ya (get_current_user lo rechaza) y borrar los datos por lotes en el worker
+    u.is_active = False
+    job = UserPurgeORM(user_id=user_id)
+    db.add(job)
+    _enqueue(db, "user.purge", user_id=user_id)
     db.commit()
-    return None
+    db.refresh(job)
+    return PurgeStatus.model_validate(job)
+
+@app.get("/users/{user_id}/purge-status", response_model=PurgeStatus)
+def get_purge_status(user_id: str, db: Session = Depends(get_db)):
+    job = db.get(UserPurgeORM, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No hay borrado en curso para este usuario")
+    return PurgeStatus.model_validate(job)
 
 
 # --------------------------- Auth ---------------------------
 @app.post("/auth/login", response_model=TokenResponse)
 def auth_login(payload: LoginPayload, db: Session = Depends(get_db)):
-    name = payload.username.strip().lower()
-    stmt = select(UserORM).where(or_(func.lower(UserORM.username) == name, func.lower(UserORM.email) == name))
+    name = _norm(payload.username)
+    stmt = select(UserORM).where(or_(UserORM.username_norm == name, UserORM.email_norm == name))
     user = db.scalars(stmt).first()
     if not user or not user.password_hash or not verify_password(payload.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
+    if not user.is_active:
+        raise HTTPException(status_code=403, detail="Usuario desactivado")
     token = create_access_token(user.id)
     return TokenResponse(access_token=token, user=User.model_validate(user))
 
@@ -489,7 +1029,7 @@ def auth_me(user: UserORM = Depends(get_current_user)):
 @app.get("/points/me", response_model=PointsOut)
 def get_my_points(user: UserORM = Depends(get_current_user), db: Session = Depends(get_db)):
     row = _ensure_points_row(db, user.id)
-    return PointsOut.model_validate(row)
+    return PointsOut.model_validate(row).model_copy(update={"pending": _pending_points(db, user.id)})
 
 @app.post("/points/add", response_model=PointsOut)
 def add_my_points(payload: AddPointsPayload, user: UserORM = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -552,7 +1092,7 @@ def send_friend_request(payload: FriendRequestCreate, db: Session = Depends(get_
     if payload.to_user_id:
         other = db.get(UserORM, payload.to_user_id)
     elif payload.to_username:
-        stmt = select(UserORM).where(func.lower(UserORM.username) == payload.to_username.strip().lower())
+        stmt = select(UserORM).where(UserORM.username_norm == _norm(payload.to_username))
         other = db.scalars(stmt).first()
     if not other:
         raise HTTPException(status_code=404, detail="Usuario destino no encontrado")
@@ -615,7 +1155,12 @@ def remove_friend(other_user_id: str, db: Session = Depends(get_db), me: UserORM
     return None
 
 @app.get("/friends", response_model=List[User])
-def list_friends(db: Session = Depends(get_db), me: UserORM = Depends(get_current_user)):
+def list_friends(
+    fields: Optional[str] = Query(None, description="Campos a devolver, p.ej. id,username"),
+    db: Session = Depends(get_db),
+    me: UserORM = Depends(get_current_user),
+):
+    wanted = _parse_fields(fields, User)
     stmt = select(FriendORM).where(
         FriendORM.status == "accepted",
         or_(FriendORM.user_a_id == me.id, FriendORM.user_b_id == me.id),
@@ -624,6 +1169,9 @@ def list_friends(db: Session = Depends(get_db), me: UserORM = Depends(get_curren
     friend_ids = [(r.user_b_id if r.user_a_id == me.id else r.user_a_id) for r in rows]
     if not friend_ids:
         return []
+    if wanted:
+        ustmt = select(*_columns(UserORM, wanted)).where(UserORM.id.in_(friend_ids))
+        return _fields_response([User.model_construct(**r) for r in db.execute(ustmt).mappings()], wanted)
     ustmt = select(UserORM).where(UserORM.id.in_(friend_ids))
     return [User.model_validate(u) for u in db.scalars(ustmt).all()]
 
@@ -650,6 +1198,73 @@ def _owner_activity(db: Session, me_id: str, activity_id: str) -> ActivityORM:
         raise HTTPException(status_code=404, detail="Actividad no encontrada")
     return a
 
+def _validated_rrule(raw: Optional[str], due_date: Optional[date]) -> Optional[str]:
+    if not raw:
+        return None
+    if due_date is None:
+        raise HTTPException(status_code=400, detail="Una actividad recurrente necesita due_date (inicio de la regla)")
+    try:
+        _parse_rrule(raw)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"rrule inválida: {e}")
+    return raw.strip().upper().removeprefix("RRULE:")
+
+def _expand_recurring(
+    db: Session, templates: List[ActivityORM], start: date, end: date, per_activity: Optional[int] = None
+) -> List[ActivityOut]:
+    """Expande las plantillas recurrentes en [start, end] y cruza con sus completados (una sola query)."""
+    if not templates:
+        return []
+    done = {
+        (c.activity_id, c.occurrence_date): c.done_at
+        for c in db.scalars(
+            select(ActivityCompletionORM).where(
+                ActivityCompletionORM.activity_id.in_([a.id for a in templates]),
+                ActivityCompletionORM.occurrence_date >= start,
+                ActivityCompletionORM.occurrence_date <= end,
+            )
+        ).all()
+    }
+    out = []
+    for a in templates:
+        base = ActivityOut.model_validate(a)
+        for d in _expand_rrule(_parse_rrule(a.rrule), a.due_date, start, end, limit=per_activity):
+            done_at = done.get((a.id, d))
+            out.append(base.model_copy(update={
+                "due_date": d,
+                "occurrence_date": d,
+                "is_done": done_at is not None,
+                "done_at": done_at,
+            }))
+    return out
+
+# columnas que siempre hacen falta para ordenar/mezclar, aunque no se pidan en ?fields=
+_ACTIVITY_SORT_COLUMNS = ("is_done", "due_date", "created_at")
+
+def _activity_select(wanted: Optional[List[str]]):
+    if not wanted:
+        return select(ActivityORM)
+    return select(*_columns(ActivityORM, dict.fromkeys([*wanted, *_ACTIVITY_SORT_COLUMNS])))
+
+def _activity_rows(db: Session, stmt, wanted: Optional[List[str]]) -> List[ActivityOut]:
+    if not wanted:
+        return [ActivityOut.model_validate(x) for x in db.scalars(stmt).all()]
+    return [ActivityOut.model_construct(**r) for r in db.execute(stmt).mappings()]
+
+def _next_pending(db: Session, templates: List[ActivityORM], today: date) -> List[ActivityOut]:
+    """Una sola ocurrencia por recurrente: la de hoy si está pendiente, si no la siguiente."""
+    end = today + timedelta(days=RECURRENCE_MAX_WINDOW_DAYS)
+    out, seen = [], set()
+    for x in _expand_recurring(db, templates, today, end, per_activity=8):
+        if not x.is_done and x.id not in seen:
+            seen.add(x.id)
+            out.append(x)
+    return out
+
+def _activity_sort_key(x: ActivityOut):
+    # mismo orden que el ORDER BY de list_activities
+    return (x.is_done, x.due_date is None, x.due_date or date.max, -x.created_at.timestamp())
+
 @app.post("/activities", response_model=ActivityOut, status_code=201)
 def create_activity(payload: ActivityCreate, db: Session = Depends(get_db), me: UserORM = Depends(get_current_user)):
     a = ActivityORM(
@@ -664,6 +1279,7 @@ def create_activity(payload: ActivityCreate, db: Session = Depends(get_db), me:
         radius_m=payload.radius_m or 150,
         due_date=payload.due_date,
         points_on_complete=payload.points_on_complete or 5,
+        rrule=_validated_rrule(payload.rrule, payload.due_date),
     )
     db.add(a)
     db.commit()
@@ -678,10 +1294,13 @@ def list_activities(
     due_to: Optional[date] = None,
     limit: int = 100,
     offset: int = 0,
+    fields: Optional[str] = Query(None, description="Campos a devolver, p.ej. id,title,due_date"),
     db: Session = Depends(get_db),
     me: UserORM = Depends(get_current_user),
 ):
-    stmt = select(ActivityORM).where(ActivityORM.user_id == me.id)
+    wanted = _parse_fields(fields, ActivityOut)
+    # actividades simples (una fila = una ocurrencia)
+    stmt = _activity_select(wanted).where(ActivityORM.user_id == me.id, ActivityORM.rrule.is_(None))
 
     if status == "pending":
         stmt = stmt.where(ActivityORM.is_done.is_(False))
@@ -699,22 +1318,76 @@ def list_activities(
     if due_to is not None:
         stmt = stmt.where(ActivityORM.due_date <= due_to)
 
+    # Se pide offset+limit para poder mezclar con las recurrentes y paginar después.
     stmt = stmt.order_by(
         ActivityORM.is_done.asc(),
         ActivityORM.due_date.is_(None),   # None al final
         ActivityORM.due_date.asc(),
         ActivityORM.created_at.desc(),
-    ).offset(offset).limit(limit)
+    ).limit(offset + limit)
+    rows = _activity_rows(db, stmt, wanted)
+
+    # recurrentes: sin fechas ni filtro de día, el historial reciente (hechas) y la próxima
+    # ocurrencia pendiente de cada una, no un abanico de 30 días con el mismo id
+    if date_filter is None and due_from is None and due_to is None:
+        tstmt = select(ActivityORM).where(
+            ActivityORM.user_id == me.id,
+            ActivityORM.rrule.is_not(None),
+            ActivityORM.due_date <= today + timedelta(days=RECURRENCE_MAX_WINDOW_DAYS),
+        )
+        templates = db.scalars(tstmt).all()
+        occurrences = []
+        if status in ("done", "all"):
+            past = _expand_recurring(db, templates, today - timedelta(days=RECURRENCE_WINDOW_DAYS), today)
+            occurrences += [x for x in past if x.is_done]
+        if status in ("pending", "all"):
+            occurrences += _next_pending(db, templates, today)
+        merged = sorted(rows + occurrences, key=_activity_sort_key)[offset:offset + limit]
+        return _fields_response(merged, wanted) if wanted else merged
+
+    # con fechas: se expanden en la ventana pedida
+    if date_filter == "today":
+        start = end = today
+    elif date_filter == "overdue":
+        start, end = today - timedelta(days=RECURRENCE_WINDOW_DAYS), today - timedelta(days=1)
+    else:
+        start = due_from or (_shift_days(due_to, -RECURRENCE_WINDOW_DAYS) if due_to < today else today)
+        end = due_to or _shift_days(start, RECURRENCE_WINDOW_DAYS)
+    if due_from is not None:
+        start = max(start, due_from)
+    if due_to is not None:
+        end = min(end, due_to)
+    if (end - start).days > RECURRENCE_MAX_WINDOW_DAYS:
+        end = _shift_days(start, RECURRENCE_MAX_WINDOW_DAYS)
+
+    tstmt = select(ActivityORM).where(
+        ActivityORM.user_id == me.id,
+        ActivityORM.rrule.is_not(None),
+        ActivityORM.due_date <= end,
+    )
+    occurrences = _expand_recurring(db, db.scalars(tstmt).all(), start, end)
+    if status == "pending" or date_filter == "overdue":
+        occurrences = [x for x in occurrences if not x.is_done]
+    elif status == "done":
+        occurrences = [x for x in occurrences if x.is_done]
 
-    rows = db.scalars(stmt).all()
-    return [ActivityOut.model_validate(x) for x in rows]
+    merged = sorted(rows + occurrences, key=_activity_sort_key)[offset:offset + limit]
+    return _fields_response(merged, wanted) if wanted else merged
 
 @app.get("/activities/today", response_model=List[ActivityOut])
-def list_today(db: Session = Depends(get_db), me: UserORM = Depends(get_current_user)):
+def list_today(
+    fields: Optional[str] = Query(None, description="Campos a devolver, p.ej. id,title,due_date"),
+    db: Session = Depends(get_db),
+    me: UserORM = Depends(get_current_user),
+):
+    wanted = _parse_fields(fields, ActivityOut)
     t = date.today()
-    stmt = select(ActivityORM).where(ActivityORM.user_id == me.id, ActivityORM.due_date == t).order_by(ActivityORM.created_at.desc())
-    rows = db.scalars(stmt).all()
-    return [ActivityOut.model_validate(x) for x in rows]
+    stmt = _activity_select(wanted).where(ActivityORM.user_id == me.id, ActivityORM.due_date == t, ActivityORM.rrule.is_(None))
+    rows = _activity_rows(db, stmt, wanted)
+    tstmt = select(ActivityORM).where(ActivityORM.user_id == me.id, ActivityORM.rrule.is_not(None), ActivityORM.due_date <= t)
+    rows += _expand_recurring(db, db.scalars(tstmt).all(), t, t)
+    rows = sorted(rows, key=lambda x: x.created_at, reverse=True)
+    return _fields_response(rows, wanted) if wanted else rows
 
 @app.get("/activities/{activity_id}", response_model=ActivityOut)
 def get_activity(activity_id: str, db: Session = Depends(get_db), me: UserORM = Depends(get_current_user)):
@@ -735,8 +1408,11 @@ def update_activity(activity_id: str, payload: ActivityUpdate, db: Session = Dep
     if payload.radius_m is not None: a.radius_m = payload.radius_m
     if payload.due_date is not None: a.due_date = payload.due_date
     if payload.points_on_complete is not None: a.points_on_complete = payload.points_on_complete
+    if payload.rrule is not None: a.rrule = _validated_rrule(payload.rrule, a.due_date)
 
     if payload.is_done is not None:
+        if a.rrule:
+            raise HTTPException(status_code=400, detail="Actividad recurrente: usa /complete con occurrence_date")
         a.is_done = payload.is_done
         a.done_at = datetime.utcnow() if a.is_done else None
 
@@ -768,8 +1444,22 @@ def complete_activity(
     me: UserORM = Depends(get_current_user)
 ):
     a = _owner_activity(db, me.id, activity_id)
-    if a.is_done:
-        return ActivityOut.model_validate(a)
+
+    occ = None
+    if a.rrule:
+        occ = payload.occurrence_date or date.today()
+        if not _expand_rrule(_parse_rrule(a.rrule), a.due_date, occ, occ):
+            raise HTTPException(status_code=400, detail="La fecha no es una ocurrencia de esta actividad")
+        done = db.scalars(select(ActivityCompletionORM).where(
+            ActivityCompletionORM.activity_id == a.id, ActivityCompletionORM.occurrence_date == occ
+        )).first()
+        if done:
+            return ActivityOut.model_validate(a).model_copy(update={
+                "due_date": occ, "occurrence_date": occ, "is_done": True, "done_at": done.done_at,
+                "awarded_points": 0,
+            })
+    elif a.is_done:
+        return ActivityOut.model_validate(a).model_copy(update={"awarded_points": 0})
 
     # verificación opcional de ubicación
     if payload.verify_location and a.place_lat is not None and a.place_lon is not None:
@@ -779,19 +1469,319 @@ def complete_activity(
         if dist > float(a.radius_m or 150):
             raise HTTPException(status_code=403, detail=f"Fuera de zona ({int(dist)} m)")
 
-    # marcar como hecha
-    a.is_done = True
-    a.done_at = datetime.utcnow()
-    db.commit()
-    db.refresh(a)
+    # marcar como hecha (en recurrentes, solo la ocurrencia)
+    now = datetime.utcnow()
+    if occ is not None:
+        db.add(ActivityCompletionORM(activity_id=a.id, user_id=me.id, occurrence_date=occ, done_at=now))
+    else:
+        a.is_done = True
+        a.done_at = now
 
-    # puntos
+    # puntos: se encolan en la misma transacción y los suma el worker
     pts = payload.points if payload.points is not None else (a.points_on_complete or 0)
     if pts > 0:
-        _add_points(db, me.id, pts)
+        _enqueue(db, "points.grant", user_id=me.id, amount=pts)
 
-    return ActivityOut.model_validate(a)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Ocurrencia ya completada")
+    db.refresh(a)
+
+    awarded = max(pts, 0)
+    if occ is not None:
+        return ActivityOut.model_validate(a).model_copy(update={
+            "due_date": occ, "occurrence_date": occ, "is_done": True, "done_at": now,
+            "awarded_points": awarded,
+        })
+    return ActivityOut.model_validate(a).model_copy(update={"awarded_points": awarded})
+
+
+# --------------------------- Geo (proxy Nominatim / teselas OSM) ---------------------------
+# El selector de lugar del cliente pasa por aquí en vez de ir directo a OpenStreetMap:
+# cachea búsquedas, reverse por celda de rejilla y teselas en disco, y agrupa peticiones
+# concurrentes a la misma clave en una sola llamada al upstream (las teselas se sirven desde
+# disco con FileResponse; ver geo_tile sobre zero-copy). Solo usuarios con sesión,
+# y las llamadas al upstream se espacian por proceso (Nominatim: 1 petición/s).
+GEO_NOMINATIM_URL = os.getenv("GEO_NOMINATIM_URL", "https://nominatim.openstreetmap.org").rstrip("/")
+GEO_TILE_URL = os.getenv("GEO_TILE_URL", "https://tile.openstreetmap.org/{z}/{x}/{y}.png")
+GEO_USER_AGENT = os.getenv("GEO_USER_AGENT", "DailyCulture/1.1 (backend proxy)")
+GEO_TIMEOUT_S = 10
+GEO_CACHE_TTL_S = 24 * 3600
+GEO_CACHE_MAX_ENTRIES = 5000
+GEO_REVERSE_GRID_DEG = float(os.getenv("GEO_REVERSE_GRID_DEG", "0.0005"))  # ~55 m de latitud
+GEO_TILE_CACHE_DIR = os.getenv("GEO_TILE_CACHE_DIR", "./tile_cache")
+GEO_TILE_CACHE_MAX_BYTES = int(os.getenv("GEO_TILE_CACHE_MAX_MB", "200")) * 1024 * 1024
+GEO_TILE_MAX_ZOOM = 19
+GEO_NOMINATIM_MIN_INTERVAL_S = float(os.getenv("GEO_NOMINATIM_MIN_INTERVAL_S", "1.0"))
+GEO_TILE_MIN_INTERVAL_S = float(os.getenv("GEO_TILE_MIN_INTERVAL_S", "0.05"))
+GEO_THROTTLE_MAX_WAIT_S = 5.0  # más cola que esto: 503 en vez de acumular hilos esperando
+
+class _TTLCache:
+    """LRU en memoria con caducidad."""
+    def __init__(self, maxsize: int = GEO_CACHE_MAX_ENTRIES, ttl: float = GEO_CACHE_TTL_S):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        hit = self._data.get(key)
+        if hit is None or hit[0] < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return hit[1]
+
+    def put(self, key: str, value: bytes) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+class _TileDiskCache:
+    """Teselas en disco con desalojo LRU por tamaño total (índice en memoria, se reconstruye al arrancar).
+
+    Las teselas que se están sirviendo quedan fijadas (acquire/release) y no se desalojan
+    hasta que _PinnedFileResponse termina de enviarlas.
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root, self.max_bytes = root, max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._pins: dict = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        found = []
+        for dirpath, _, files in os.walk(root):
+            for f in files:
+                path = os.path.join(dirpath, f)
+                st = os.stat(path)
+                found.append((st.st_atime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._index[path] = size
+            self._total += size
+
+    def path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self.root, str(z), str(x), f"{y}.png")
+
+    def acquire(self, path: str) -> bool:
+        """Marca la tesela como usada y la fija; False si no está en caché (o ya no está en disco)."""
+        with self._lock:
+            if path not in self._index:
+                return False
+            if not os.path.exists(path):  # borrada por fuera
+                self._total -= self._index.pop(path)
+                return False
+            self._index.move_to_end(path)
+            self._pins[path] = self._pins.get(path, 0) + 1
+            return True
+
+    def release(self, path: str) -> None:
+        with self._lock:
+            n = self._pins.pop(path, 0) - 1
+            if n > 0:
+                self._pins[path] = n
+
+    def store(self, path: str, content: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(content)
+        os.replace(tmp, path)  # atómico: nunca se sirve una tesela a medias
+        with self._lock:
+            self._total += len(content) - self._index.pop(path, 0)
+            self._index[path] = len(content)
+            # de la más antigua a la más nueva, sin tocar las fijadas ni la recién guardada
+            for old in list(self._index):
+                if self._total <= self.max_bytes:
+                    break
+                if old == path or self._pins.get(old):
+                    continue
+                self._total -= self._index.pop(old)
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+
+class _Throttle:
+    """Espacia las llamadas al menos `interval` segundos (reserva turno y duerme hasta él)."""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            if slot - now > GEO_THROTTLE_MAX_WAIT_S:
+                raise HTTPException(status_code=503, detail="Servicio de mapas saturado, reintenta en unos segundos",
+                                    headers={"Retry-After": str(int(slot - now) + 1)})
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+_nominatim_throttle = _Throttle(GEO_NOMINATIM_MIN_INTERVAL_S)
+_tile_throttle = _Throttle(GEO_TILE_MIN_INTERVAL_S)
+
+class _PinnedFileResponse(FileResponse):
+    """FileResponse que suelta la tesela fijada al terminar, también si el envío falla
+    (un BackgroundTask no se ejecuta cuando el cliente se desconecta a mitad)."""
+    def __init__(self, path: str, cache: _TileDiskCache, **kwargs):
+        super().__init__(path, **kwargs)
+        self._cache = cache
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._cache.release(self.path)
+
+_geo_search_cache = _TTLCache()
+_geo_reverse_cache = _TTLCache()
+_tile_cache: Optional[_TileDiskCache] = None
+_geo_inflight: dict = {}
+
+def _tiles() -> _TileDiskCache:
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = _TileDiskCache(GEO_TILE_CACHE_DIR, GEO_TILE_CACHE_MAX_BYTES)
+    return _tile_cache
+
+def _geo_fetch(url: str, throttle: _Throttle) -> bytes:
+    throttle.wait()
+    req = urllib.request.Request(url, headers={"User-Agent": GEO_USER_AGENT})
+    try:
+        with urllib.request.urlopen(req, timeout=GEO_TIMEOUT_S) as res:
+            return res.read()
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            raise HTTPException(status_code=404, detail="No encontrado en el servicio de mapas")
+        print("Geo upstream failed:", url, repr(e))
+        raise HTTPException(status_code=502, detail="Servicio de mapas no disponible")
+    except (urllib.error.URLError, TimeoutError) as e:
+        print("Geo upstream failed:", url, repr(e))
+        raise HTTPException(status_code=502, detail="Servicio de mapas no disponible")
+
+def _geo_user(creds: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """get_current_user con una sesión propia que se cierra ya: no queda una transacción
+    de lectura abierta (en SQLite, bloqueando escritores) mientras se espera al upstream."""
+    with SessionLocal() as db:
+        return get_current_user(creds, db).id
+
+async def _coalesced(key: str, fn):
+    """Ejecuta fn (bloqueante) en un hilo; las peticiones simultáneas con la misma clave esperan a la misma."""
+    task = _geo_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(fn))
+        _geo_inflight[key] = task
+        task.add_done_callback(lambda _t: _geo_inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+async def _geo_json(cache: _TTLCache, path: str, params: dict) -> Response:
+    url = f"{GEO_NOMINATIM_URL}/{path}?{urllib.parse.urlencode({**params, 'format': 'json'})}"
+    body = cache.get(url)
+    if body is None:
+        body = await _coalesced(url, lambda: _geo_fetch(url, _nominatim_throttle))
+        cache.put(url, body)
+    return Response(content=body, media_type="application/json")
+
+@app.get("/geo/search")
+async def geo_search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(5, ge=1, le=20),
+    addressdetails: int = Query(0, ge=0, le=1),
+    accept_language: str = Query("es", alias="accept-language", max_length=20),
+    _uid: str = Depends(_geo_user),
+):
+    params = {"q": " ".join(q.lower().split()), "limit": limit, "addressdetails": addressdetails,
+              "accept-language": accept_language}
+    return await _geo_json(_geo_search_cache, "search", params)
+
+@app.get("/geo/reverse")
+async def geo_reverse(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(18, ge=0, le=18),
+    accept_language: str = Query("es", alias="accept-language", max_length=20),
+    _uid: str = Depends(_geo_user),
+):
+    # pins cercanos caen en la misma celda y comparten entrada: se consulta el centro de la celda
+    g = GEO_REVERSE_GRID_DEG
+    params = {"lat": f"{round(lat / g) * g:.6f}", "lon": f"{round(lon / g) * g:.6f}", "zoom": zoom,
+              "accept-language": accept_language}
+    return await _geo_json(_geo_reverse_cache, "reverse", params)
+
+@app.get("/geo/tiles/{z}/{x}/{y}")
+async def geo_tile(z: int, x: int, y: int, _uid: str = Depends(_geo_user)):
+    if not 0 <= z <= GEO_TILE_MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=404, detail="Tesela fuera de rango")
+    cache = _tiles()
+    path = cache.path(z, x, y)
+
+    def _miss():
+        cache.store(path, _geo_fetch(GEO_TILE_URL.format(z=z, x=x, y=y), _tile_throttle))
+
+    # si otra petición la desaloja entre el store y el acquire, se vuelve a pedir
+    for _ in range(3):
+        if cache.acquire(path):
+            # No es zero-copy con el despliegue actual: uvicorn no implementa la extensión ASGI
+            # http.response.pathsend, así que FileResponse lee el fichero en trozos de 64 KiB y los
+            # pasa por Python (una tesela cabe en un trozo y suele estar en la caché de páginas).
+            # Con un servidor que sí la implemente (p.ej. Granian) se usa sendfile sin cambiar nada.
+            # La tesela sigue fijada hasta que termina el envío (o falla).
+            return _PinnedFileResponse(
+                path,
+                cache,
+                media_type="image/png",
+                headers={"Cache-Control": "public, max-age=604800"},
+            )
+        await _coalesced(path, _miss)
+    raise HTTPException(status_code=502, detail="Servicio de mapas no disponible")
 
 
 # --------------------------- Crear tablas (AL FINAL) ---------------------------
 Base.metadata.create_all(engine)
+
+# Migraciones ligeras: create_all no añade columnas nuevas a tablas ya existentes.
+_ADDED_COLUMNS = {
+    "activities": {"rrule": "VARCHAR(200)"},
+    "users": {"email_norm": "VARCHAR(255)", "username_norm": "VARCHAR(30)"},
+    "outbox": {"user_id": "VARCHAR(36)"},
+}
+
+def _backfill_user_norms(conn):
+    rows = conn.execute(text("SELECT id, email, username FROM users")).all()
+    for uid, email, username in rows:
+        conn.execute(
+            text("UPDATE users SET email_norm = :e, username_norm = :u WHERE id = :id"),
+            {"e": _norm(email), "u": _norm(username), "id": uid},
+        )
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email_norm ON users (email_norm)"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username_norm ON users (username_norm)"))
+
+def _index_outbox_user(conn):
+    # los eventos anteriores no tienen user_id: solo afecta a `pending` mientras se drenan
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_outbox_user_id ON outbox (user_id)"))
+
+# pasos a ejecutar cuando se añade la columna indicada
+_BACKFILLS = {
+    ("users", "username_norm"): _backfill_user_norms,
+    ("outbox", "user_id"): _index_outbox_user,
+}
+
+def _add_missing_columns():
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        added = []
+        for table, cols in _ADDED_COLUMNS.items():
+            existing = {c["name"] for c in insp.get_columns(table)}
+            for name, ddl in cols.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+                    added.append((table, name))
+        for key in added:
+            if key in _BACKFILLS:
+                _BACKFILLS[key](conn)
+
+_add_missing_columns()
@@ -0,0 +1,107 @@
+# bench_purge.py
+# Latencia de escrituras concurrentes mientras se borra un usuario con muchas actividades:
+# un único DELETE en cascada frente a la purga por lotes con el worker real del outbox.
+# Uso: python bench_purge.py [--rows 200000]
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["OUTBOX_INPROCESS"] = "0"
+
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, insert, select
+
+import app
+
+
+def _create_user(c: TestClient, name: str, rows: int) -> str:
+    c.post("/users", json={"email": f"{name}@example.com", "username": name, "password": "12345678"})
+    with app.SessionLocal() as db:
+        uid = db.scalar(select(app.UserORM.id).where(app.UserORM.username_norm == name))
+        batch = 10000
+        for i in range(0, rows, batch):
+            db.execute(insert(app.ActivityORM), [
+                dict(id=f"{name}-{j}", user_id=uid, title="t", kind="custom", radius_m=150,
+                     points_on_complete=5, is_done=False)
+                for j in range(i, min(i + batch, rows))
+            ])
+        db.commit()
+    return uid
+
+
+class _Writer(threading.Thread):
+    """Inserta actividades de otro usuario en bucle y anota la latencia de cada commit."""
+    def __init__(self, user_id: str):
+        super().__init__(daemon=True)
+        self.user_id, self.latencies, self.stop = user_id, [], threading.Event()
+
+    def run(self):
+        while not self.stop.is_set():
+            t0 = time.perf_counter()
+            with app.SessionLocal() as db:
+                db.add(app.ActivityORM(user_id=self.user_id, title="w"))
+                db.commit()
+            self.latencies.append((time.perf_counter() - t0) * 1000)
+            time.sleep(0.005)
+
+
+def _report(label: str, total_s: float, lat: list) -> None:
+    lat = sorted(lat)
+    pct = lambda p: lat[min(len(lat) - 1, int(len(lat) * p))]
+    print(f"{label:18s} total {total_s:6.1f} s | {len(lat)} writes, "
+          f"p50 {pct(0.5):.0f} ms, p99 {pct(0.99):.0f} ms, max {lat[-1]:.0f} ms")
+
+
+def _with_writer(writer_id: str, fn) -> tuple:
+    w = _Writer(writer_id)
+    w.start()
+    time.sleep(0.2)
+    w.latencies.clear()
+    t0 = time.perf_counter()
+    fn()
+    total = time.perf_counter() - t0
+    w.stop.set()
+    w.join()
+    return total, w.latencies
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200000)
+    args = ap.parse_args()
+
+    c = TestClient(app.app)
+    writer_id = _create_user(c, "writer", 0)
+    app._drain_outbox()
+
+    # 1) un único DELETE con ON DELETE CASCADE (lo que hacía delete_user antes)
+    uid = _create_user(c, "cascade", args.rows)
+    def _cascade():
+        with app.SessionLocal() as db:
+            db.execute(delete(app.UserORM).where(app.UserORM.id == uid))
+            db.commit()
+    _report("cascade DELETE", *_with_writer(writer_id, _cascade))
+
+    # 2) DELETE /users/{id} + worker real del outbox hasta que la purga termina
+    uid = _create_user(c, "chunked", args.rows)
+    app._drain_outbox()
+    def _chunked():
+        assert c.delete(f"/users/{uid}").status_code == 202
+        async def run():
+            stop = asyncio.Event()
+            worker = asyncio.create_task(app.run_outbox_worker(stop))
+            while c.get(f"/users/{uid}/purge-status").json()["status"] != "done":
+                await asyncio.sleep(0.05)
+            stop.set()
+            await worker
+        asyncio.run(run())
+    print(f"chunk size {app.PURGE_CHUNK_SIZE}, pause {app.PURGE_CHUNK_PAUSE_S} s, poll {app.OUTBOX_POLL_S} s")
+    _report("chunked purge", *_with_writer(writer_id, _chunked))
+
+
+if __name__ == "__main__":
+    main()
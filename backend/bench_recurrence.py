@@ -0,0 +1,83 @@
+# bench_recurrence.py
+# Compara hábitos materializados (una fila por día) con reglas RRULE + tabla de completados.
+# Uso: python bench_recurrence.py [--habits 20] [--days 365] [--runs 50]
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["OUTBOX_INPROCESS"] = "0"
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, insert, select
+
+import app
+
+
+def _login(c: TestClient, name: str) -> dict:
+    c.post("/users", json={"email": f"{name}@example.com", "username": name, "password": "12345678"})
+    token = c.post("/auth/login", json={"username": name, "password": "12345678"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _user_id(db, name: str) -> str:
+    return db.scalar(select(app.UserORM.id).where(app.UserORM.username_norm == name))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--habits", type=int, default=20)
+    ap.add_argument("--days", type=int, default=365, help="días de historial (la mitad completados)")
+    ap.add_argument("--runs", type=int, default=50)
+    args = ap.parse_args()
+
+    c = TestClient(app.app)
+    headers = {"materialized": _login(c, "mat"), "rule": _login(c, "rule")}
+    today = date.today()
+    first = today - timedelta(days=args.days)
+    now = datetime.utcnow()
+
+    with app.SessionLocal() as db:
+        mat, rule = _user_id(db, "mat"), _user_id(db, "rule")
+        rows, completions = [], []
+        for h in range(args.habits):
+            # materializado: el cliente crea una fila por día (historial + 30 días por delante)
+            for d in range(args.days + app.RECURRENCE_WINDOW_DAYS):
+                rows.append(dict(id=f"m{h}-{d}", user_id=mat, title=f"hábito {h}", kind="custom", radius_m=150,
+                                 points_on_complete=5, due_date=first + timedelta(days=d),
+                                 is_done=d < args.days and d % 2 == 0))
+            rows.append(dict(id=f"r{h}", user_id=rule, title=f"hábito {h}", kind="custom", radius_m=150,
+                             points_on_complete=5, due_date=first, rrule="FREQ=DAILY", is_done=False))
+            for d in range(0, args.days, 2):
+                completions.append(dict(id=f"c{h}-{d}", activity_id=f"r{h}", user_id=rule,
+                                        occurrence_date=first + timedelta(days=d), done_at=now))
+        db.execute(insert(app.ActivityORM), rows)
+        db.execute(insert(app.ActivityCompletionORM), completions)
+        db.commit()
+        for name, uid in (("materialized", mat), ("rule", rule)):
+            n_act = db.scalar(select(func.count()).select_from(app.ActivityORM).where(app.ActivityORM.user_id == uid))
+            n_done = db.scalar(select(func.count()).select_from(app.ActivityCompletionORM)
+                               .where(app.ActivityCompletionORM.user_id == uid))
+            print(f"{name:13s} activities={n_act} completions={n_done}")
+
+    window = {"due_from": str(today), "due_to": str(today + timedelta(days=29)), "limit": 1000}
+    cases = [
+        ("/activities/today", {}),
+        ("/activities (30 días)", window),
+        ("/activities?status=pending", {"status": "pending", "limit": 1000}),
+    ]
+    for label, params in cases:
+        path = label.split(" ")[0].split("?")[0]
+        for name, h in headers.items():
+            r = c.get(path, params=params, headers=h)  # calentar
+            t0 = time.perf_counter()
+            for _ in range(args.runs):
+                r = c.get(path, params=params, headers=h)
+            ms = (time.perf_counter() - t0) / args.runs * 1000
+            print(f"{label:28s} {name:13s} {len(r.json()):5d} items {ms:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
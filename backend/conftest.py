@@ -0,0 +1,28 @@
+# conftest.py
+# Los tests usan una BD SQLite temporal y sin worker en proceso (se drena el outbox a mano).
+import os
+import tempfile
+from uuid import uuid4
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ.setdefault("OUTBOX_INPROCESS", "0")
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    return TestClient(app.app)
+
+
+@pytest.fixture
+def auth(client):
+    """Crea un usuario nuevo y devuelve las cabeceras con su token."""
+    name = "u" + uuid4().hex[:12]
+    r = client.post("/users", json={"email": f"{name}@example.com", "username": name, "password": "12345678"})
+    assert r.status_code == 201, r.text
+    r = client.post("/auth/login", json={"username": name, "password": "12345678"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
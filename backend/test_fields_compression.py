@@ -0,0 +1,146 @@
+# test_fields_compression.py
+# Proyección ?fields= (también en el SELECT) y compresión negociada de respuestas.
+import gzip
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import app
+
+BR = "br" if app.brotli else "gzip"
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("GZIP", "gzip"),
+    ("gzip, br", BR),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=0, br;q=0", None),
+    ("gzip;q=0.9, br;q=0.1", "gzip"),
+    ("gzip;q=0.5, br;q=0.9", BR),
+    ("gzip;q=abc", None),
+    ("*", BR),
+    ("*;q=0", None),
+    ("*, br;q=0", "gzip"),
+    ("deflate, gzip ; q=0.2", "gzip"),
+])
+def test_pick_encoding(accept, expected):
+    assert app._pick_encoding(accept) == expected
+
+
+@pytest.fixture
+def sql():
+    """Sentencias SQL ejecutadas durante el test."""
+    seen = []
+
+    def _log(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(app.engine, "before_cursor_execute", _log)
+    yield seen
+    event.remove(app.engine, "before_cursor_execute", _log)
+
+
+@pytest.fixture
+def activities(client, auth):
+    for i in range(30):
+        r = client.post("/activities", headers=auth, json={
+            "title": f"Actividad {i}", "notes": "n" * 900, "url": f"https://example.com/{i}", "due_date": "2030-01-01",
+        })
+        assert r.status_code == 201
+    return auth
+
+
+def test_activities_fields_narrow_select_and_body(client, activities, sql):
+    r = client.get("/activities", headers=activities, params={"fields": "id,title"})
+    assert r.status_code == 200
+    assert len(r.json()) == 30
+    assert all(set(x) == {"id", "title"} for x in r.json())
+    select_sql = next(s for s in sql if "FROM activities" in s and "activity_completions" not in s)
+    assert "activities.title" in select_sql
+    assert "activities.notes" not in select_sql and "activities.url" not in select_sql
+
+
+def test_today_users_and_friends_fields(client, auth):
+    client.post("/activities", headers=auth, json={"title": "Hoy", "notes": "x" * 100,
+                                                   "due_date": str(date.today())})
+    today = client.get("/activities/today", headers=auth, params={"fields": "title"}).json()
+    assert today == [{"title": "Hoy"}]
+    users = client.get("/users", params={"fields": "id,username", "limit": 5}).json()
+    assert users and all(set(u) == {"id", "username"} for u in users)
+    assert client.get("/friends", headers=auth, params={"fields": "username"}).json() == []
+
+
+@pytest.mark.parametrize("path", ["/activities", "/activities/today", "/users", "/friends"])
+def test_unknown_fields_are_rejected(client, auth, path):
+    r = client.get(path, headers=auth, params={"fields": "id,password_hash"})
+    assert r.status_code == 400
+    assert "password_hash" in r.json()["detail"]
+
+
+def test_large_json_is_compressed(client, activities):
+    plain = client.get("/activities", headers={**activities, "Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert len(plain.content) >= app.COMPRESS_MIN_BYTES
+
+    r = client.get("/activities", headers={**activities, "Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in r.headers["vary"].lower()
+    assert int(r.headers["content-length"]) < len(plain.content)
+    assert r.json() == plain.json()
+
+    r = client.get("/activities", headers={**activities, "Accept-Encoding": "br;q=0, gzip;q=0"})
+    assert "content-encoding" not in r.headers
+
+
+@pytest.mark.skipif(app.brotli is None, reason="brotli no instalado")
+def test_brotli_preferred_when_available(client, activities):
+    r = client.get("/activities", headers={**activities, "Accept-Encoding": "gzip, br"})
+    assert r.headers["content-encoding"] == "br"
+    assert len(r.json()) == 30
+
+
+def test_small_responses_are_not_compressed(client):
+    r = client.get("/health", headers={"Accept-Encoding": "gzip"})
+    assert len(r.content) < app.COMPRESS_MIN_BYTES
+    assert "content-encoding" not in r.headers
+
+
+def _wrapped(endpoint):
+    return TestClient(app.CompressionMiddleware(Starlette(routes=[Route("/", endpoint)]), minimum_size=100))
+
+
+def test_streaming_and_non_text_pass_through():
+    async def stream(request):
+        async def chunks():
+            for _ in range(5):
+                yield b"x" * 1000
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    r = _wrapped(stream).get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers and r.content == b"x" * 5000
+
+    async def png(request):
+        return Response(b"x" * 500, media_type="image/png")
+
+    r = _wrapped(png).get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers
+
+
+def test_already_encoded_is_not_recompressed():
+    body = gzip.compress(b'{"a": "' + b"x" * 500 + b'"}')
+
+    async def pre(request):
+        return Response(body, media_type="application/json", headers={"Content-Encoding": "gzip"})
+
+    r = _wrapped(pre).get("/", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.json() == {"a": "x" * 500}
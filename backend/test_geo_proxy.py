@@ -0,0 +1,181 @@
+# test_geo_proxy.py
+# Comprueba el proxy /geo/* contra un Nominatim/servidor de teselas falso en local.
+# Uso: pip install -r requirements-dev.txt && python -m pytest -q test_geo_proxy.py
+import asyncio
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import app
+
+UPSTREAM_DELAY_S = 0.2
+TILE_BYTES = 1000
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    """Nominatim + teselas: /search, /reverse, /{z}/{x}/{y}.png. z=7 responde 404, z=8 responde 500."""
+    hits: list = []
+    hit_times: list = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).hits.append(self.path)
+        type(self).hit_times.append(time.monotonic())
+        time.sleep(UPSTREAM_DELAY_S)  # deja tiempo a que las peticiones concurrentes se solapen
+        if self.path.startswith(("/search", "/reverse")):
+            body, ctype = b'{"display_name": "Madrid"}', "application/json"
+        elif self.path.startswith("/7/"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        elif self.path.startswith("/8/"):
+            self.send_response(500)
+            self.end_headers()
+            return
+        else:
+            body, ctype = b"\x89PNG" + b"x" * (TILE_BYTES - 4), "image/png"
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope="module")
+def upstream():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Upstream)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+
+
+@pytest.fixture
+def geo(upstream, tmp_path, monkeypatch):
+    _Upstream.hits, _Upstream.hit_times = [], []
+    monkeypatch.setattr(app, "_nominatim_throttle", app._Throttle(0))
+    monkeypatch.setattr(app, "_tile_throttle", app._Throttle(0))
+    monkeypatch.setattr(app, "GEO_NOMINATIM_URL", upstream)
+    monkeypatch.setattr(app, "GEO_TILE_URL", upstream + "/{z}/{x}/{y}.png")
+    monkeypatch.setattr(app, "_tile_cache", app._TileDiskCache(str(tmp_path), 3 * TILE_BYTES))
+    monkeypatch.setattr(app, "_geo_search_cache", app._TTLCache())
+    monkeypatch.setattr(app, "_geo_reverse_cache", app._TTLCache())
+    monkeypatch.setattr(app, "_geo_inflight", {})
+    return app._tile_cache
+
+
+def _run(headers, *paths):
+    async def main():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=headers) as client:
+            return await asyncio.gather(*[client.get(p) for p in paths])
+    return asyncio.run(main())
+
+
+def _disk_bytes(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(root) for f in fs)
+
+
+def test_reverse_same_cell_shares_one_upstream_call(geo, auth):
+    paths = [f"/geo/reverse?lat={40.41681 + i * 1e-5:.5f}&lon=-3.70381" for i in range(10)]
+    res = _run(auth, *paths)
+    assert {r.status_code for r in res} == {200}
+    assert len(_Upstream.hits) == 1
+    _run(auth, paths[0])  # ya en caché
+    assert len(_Upstream.hits) == 1
+
+
+def test_concurrent_tile_misses_fetch_once(geo, auth):
+    res = _run(auth, *["/geo/tiles/3/2/1"] * 8)
+    assert {r.status_code for r in res} == {200}
+    assert all(len(r.content) == TILE_BYTES for r in res)
+    assert res[0].headers["content-type"] == "image/png"
+    assert _Upstream.hits == ["/3/2/1.png"]
+
+
+def test_lru_eviction_stays_within_budget(geo, auth):
+    for y in range(6):
+        _run(auth, f"/geo/tiles/3/2/{y}")
+    assert _disk_bytes(geo.root) <= geo.max_bytes
+    _run(auth, "/geo/tiles/3/2/5")  # la más reciente sigue en disco
+    assert len(_Upstream.hits) == 6
+    _run(auth, "/geo/tiles/3/2/0")  # la más antigua se desalojó
+    assert len(_Upstream.hits) == 7
+
+
+def test_pinned_tile_is_not_evicted(geo):
+    pinned = geo.path(3, 1, 1)
+    geo.store(pinned, b"p" * TILE_BYTES)
+    assert geo.acquire(pinned)
+    for y in range(4):
+        geo.store(geo.path(3, 1, 2 + y), b"t" * TILE_BYTES)
+    assert os.path.exists(pinned)
+    geo.release(pinned)
+    geo.store(geo.path(3, 1, 6), b"t" * TILE_BYTES)
+    assert not os.path.exists(pinned)
+
+
+def test_pin_is_released_when_client_disconnects(geo, auth):
+    _run(auth, "/geo/tiles/3/2/1")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/geo/tiles/3/2/1", "raw_path": b"/geo/tiles/3/2/1", "query_string": b"", "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in auth.items()],
+        "client": ("127.0.0.1", 1234), "server": ("test", 80),
+    }
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()  # el cliente no dice nada más; el fallo llega por send
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("connection reset by peer")
+
+    with pytest.raises(OSError):
+        asyncio.run(app.app(scope, receive, send))
+    assert geo._pins == {}
+    assert [r.status_code for r in _run(auth, "/geo/tiles/3/2/1")] == [200]
+    assert geo._pins == {}
+
+
+def test_upstream_errors_map_to_404_and_502(geo, auth):
+    not_found, failed, out_of_range = _run(auth, "/geo/tiles/7/0/0", "/geo/tiles/8/0/0", "/geo/tiles/3/9/0")
+    assert not_found.status_code == 404
+    assert failed.status_code == 502
+    assert out_of_range.status_code == 404
+    assert len(_Upstream.hits) == 2
+    assert _disk_bytes(geo.root) == 0
+
+
+def test_requires_a_session(geo):
+    res = _run({}, "/geo/search?q=prado", "/geo/reverse?lat=40.4&lon=-3.7", "/geo/tiles/3/2/1")
+    assert {r.status_code for r in res} <= {401, 403}
+    res = _run({"Authorization": "Bearer nope"}, "/geo/tiles/3/2/1")
+    assert res[0].status_code == 401
+    assert _Upstream.hits == []
+
+
+def test_nominatim_calls_are_spaced(geo, auth, monkeypatch):
+    monkeypatch.setattr(app, "_nominatim_throttle", app._Throttle(0.3))
+    res = _run(auth, "/geo/search?q=uno", "/geo/search?q=dos", "/geo/search?q=tres")
+    assert {r.status_code for r in res} == {200}
+    gaps = [b - a for a, b in zip(_Upstream.hit_times, _Upstream.hit_times[1:])]
+    assert len(gaps) == 2 and min(gaps) >= 0.25
+
+
+def test_throttle_queue_overflow_is_503(geo, auth, monkeypatch):
+    monkeypatch.setattr(app, "GEO_THROTTLE_MAX_WAIT_S", 0.5)
+    monkeypatch.setattr(app, "_nominatim_throttle", app._Throttle(0.4))
+    res = _run(auth, "/geo/search?q=uno", "/geo/search?q=dos", "/geo/search?q=tres")
+    assert sorted(r.status_code for r in res) == [200, 200, 503]
+    assert "retry-after" in next(r for r in res if r.status_code == 503).headers
+    assert len(_Upstream.hits) == 2
@@ -0,0 +1,98 @@
+# test_outbox.py
+# Outbox: efectos en segundo plano, retención de eventos procesados y purga de usuarios con el worker real.
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+
+import app
+
+
+def _me(client, auth):
+    return client.get("/auth/me", headers=auth).json()["id"]
+
+
+def _run_worker_until(done, timeout_s):
+    async def run():
+        stop = asyncio.Event()
+        worker = asyncio.create_task(app.run_outbox_worker(stop))
+        try:
+            await asyncio.wait_for(_poll(done), timeout_s)
+        finally:
+            stop.set()
+            await worker
+
+    async def _poll(fn):
+        while not fn():
+            await asyncio.sleep(0.02)
+
+    asyncio.run(run())
+
+
+def test_points_are_granted_by_the_worker(client, auth):
+    a = client.post("/activities", headers=auth, json={"title": "Exposición", "points_on_complete": 12}).json()
+    r = client.post(f"/activities/{a['id']}/complete", headers=auth)
+    assert r.json()["awarded_points"] == 12
+    pts = client.get("/points/me", headers=auth).json()
+    assert (pts["total"], pts["pending"]) == (0, 12)
+    while app._drain_outbox():
+        pass
+    pts = client.get("/points/me", headers=auth).json()
+    assert (pts["total"], pts["pending"]) == (12, 0)
+
+
+def test_dead_grants_are_not_pending(client, auth):
+    uid = _me(client, auth)
+    with app.SessionLocal() as db:
+        app._enqueue(db, "points.grant", user_id=uid, amount=30)
+        db.commit()
+        db.execute(update(app.OutboxORM).where(app.OutboxORM.user_id == uid).values(attempts=app.OUTBOX_MAX_ATTEMPTS))
+        db.commit()
+    assert client.get("/points/me", headers=auth).json()["pending"] == 0
+    with app.SessionLocal() as db:
+        db.execute(delete(app.OutboxORM).where(app.OutboxORM.user_id == uid))
+        db.commit()
+
+
+def test_prune_keeps_recent_and_dead_events():
+    old = datetime.utcnow() - timedelta(hours=app.OUTBOX_RETENTION_H + 1)
+    ids = {"old": "prune-old", "recent": "prune-recent", "dead": "prune-dead"}
+    with app.SessionLocal() as db:
+        db.execute(insert(app.OutboxORM), [
+            dict(id=ids["old"], kind="points.grant", payload="{}", processed_at=old),
+            dict(id=ids["recent"], kind="points.grant", payload="{}", processed_at=datetime.utcnow()),
+            dict(id=ids["dead"], kind="points.grant", payload="{}", created_at=old, available_at=old,
+                 attempts=app.OUTBOX_MAX_ATTEMPTS),
+        ])
+        db.commit()
+    while app._prune_outbox(batch_size=2) == 2:
+        pass
+    with app.SessionLocal() as db:
+        left = set(db.scalars(select(app.OutboxORM.id).where(app.OutboxORM.id.in_(ids.values()))))
+        assert left == {ids["recent"], ids["dead"]}
+        assert app.outbox_metrics(db)["dead"] >= 1
+        db.execute(delete(app.OutboxORM).where(app.OutboxORM.id == ids["dead"]))
+        db.commit()
+
+
+def test_purge_runs_at_chunk_pace_with_the_real_worker(client, auth, monkeypatch):
+    monkeypatch.setattr(app, "PURGE_CHUNK_SIZE", 50)
+    uid = _me(client, auth)
+    with app.SessionLocal() as db:
+        db.execute(insert(app.ActivityORM), [
+            dict(id=f"{uid}-{i}", user_id=uid, title="t", kind="custom", radius_m=150, points_on_complete=5, is_done=False)
+            for i in range(500)
+        ])
+        db.commit()
+    assert client.delete(f"/users/{uid}").status_code == 202
+    assert client.get("/auth/me", headers=auth).status_code == 403
+
+    # 11 eventos encadenados: con una espera de OUTBOX_POLL_S entre ellos no acabaría a tiempo
+    status = lambda: client.get(f"/users/{uid}/purge-status").json()
+    _run_worker_until(lambda: status()["status"] == "done", timeout_s=5 * app.OUTBOX_POLL_S)
+    assert status()["deleted_rows"] >= 501
+    with app.SessionLocal() as db:
+        assert db.get(app.UserORM, uid) is None
+        payloads = db.scalars(select(app.OutboxORM.payload).where(app.OutboxORM.kind == "user.purge")).all()
+        assert sum(json.loads(p)["user_id"] == uid for p in payloads) == 11
@@ -0,0 +1,193 @@
+# test_recurrence.py
+# Expansión de RRULE (_parse_rrule/_expand_rrule) y ventanas de /activities con recurrentes.
+from datetime import date, timedelta
+
+import pytest
+
+import app
+
+
+def _expand(raw, dtstart, start, end, limit=None):
+    return app._expand_rrule(app._parse_rrule(raw), dtstart, start, end, limit=limit)
+
+
+def _days(*ds):
+    return [date.fromisoformat(d) for d in ds]
+
+
+# --- _parse_rrule / _expand_rrule ---
+
+def test_daily_interval():
+    got = _expand("FREQ=DAILY;INTERVAL=2", date(2024, 1, 1), date(2024, 1, 4), date(2024, 1, 10))
+    assert got == _days("2024-01-05", "2024-01-07", "2024-01-09")
+
+
+def test_weekly_byday_interval():
+    # DTSTART miércoles: el lunes de esa semana es anterior y no cuenta; semanas alternas
+    got = _expand("FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE", date(2024, 1, 3), date(2024, 1, 1), date(2024, 1, 31))
+    assert got == _days("2024-01-03", "2024-01-15", "2024-01-17", "2024-01-29", "2024-01-31")
+
+
+def test_weekly_without_byday_uses_dtstart_weekday():
+    got = _expand("FREQ=WEEKLY", date(2024, 1, 3), date(2024, 1, 1), date(2024, 1, 20))
+    assert got == _days("2024-01-03", "2024-01-10", "2024-01-17")
+
+
+def test_monthly_on_31st_skips_short_months():
+    got = _expand("FREQ=MONTHLY", date(2024, 1, 31), date(2024, 1, 1), date(2024, 12, 31))
+    assert got == _days("2024-01-31", "2024-03-31", "2024-05-31", "2024-07-31",
+                        "2024-08-31", "2024-10-31", "2024-12-31")
+
+
+def test_count_counts_from_dtstart():
+    # los meses sin día 31 no existen y no consumen COUNT
+    assert _expand("FREQ=MONTHLY;COUNT=3", date(2024, 1, 31), date(2024, 1, 1), date(2025, 12, 31)) == \
+        _days("2024-01-31", "2024-03-31", "2024-05-31")
+    # ventana posterior a DTSTART: las ocurrencias anteriores siguen contando
+    assert _expand("FREQ=DAILY;COUNT=3", date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 10)) == \
+        _days("2024-01-02", "2024-01-03")
+
+
+def test_until_is_inclusive():
+    got = _expand("FREQ=DAILY;UNTIL=20240105", date(2024, 1, 1), date(2024, 1, 3), date(2024, 1, 31))
+    assert got == _days("2024-01-03", "2024-01-04", "2024-01-05")
+    assert _expand("FREQ=DAILY;UNTIL=20240105T235959Z", date(2024, 1, 1), date(2024, 1, 6), date(2024, 1, 9)) == []
+
+
+@pytest.mark.parametrize("raw", [
+    "FREQ=DAILY;INTERVAL=3",
+    "FREQ=WEEKLY;INTERVAL=3;BYDAY=TU,SA",
+    "FREQ=MONTHLY;INTERVAL=5",
+])
+def test_skip_ahead_matches_full_expansion(raw):
+    dtstart, start, end = date(2023, 1, 31), date(2024, 2, 1), date(2024, 9, 30)
+    full = _expand(raw, dtstart, dtstart, end)
+    assert _expand(raw, dtstart, start, end) == [d for d in full if d >= start]
+
+
+def test_limit_stops_early():
+    assert _expand("FREQ=DAILY", date(2024, 1, 1), date(2024, 1, 1), date(2024, 12, 31), limit=2) == \
+        _days("2024-01-01", "2024-01-02")
+
+
+def test_expansion_stops_at_calendar_bounds():
+    assert _expand("FREQ=DAILY", date(9999, 12, 25), date(9999, 12, 20), date.max) == \
+        [date(9999, 12, 25) + timedelta(days=i) for i in range(7)]
+    assert _expand("FREQ=MONTHLY", date(9999, 10, 31), date(9999, 1, 1), date.max) == \
+        _days("9999-10-31", "9999-12-31")
+    assert _expand("FREQ=WEEKLY;BYDAY=SU", date(9999, 12, 20), date(9999, 12, 20), date.max) == \
+        _days("9999-12-26")
+    assert _expand("FREQ=WEEKLY;BYDAY=MO,SU", date.min, date.min, date(1, 1, 14)) == \
+        _days("0001-01-01", "0001-01-07", "0001-01-08", "0001-01-14")
+
+
+@pytest.mark.parametrize("raw", [
+    "FREQ=YEARLY",
+    "FREQ=DAILY;BYDAY=MO",
+    "FREQ=DAILY;COUNT=2;UNTIL=20240101",
+    "FREQ=DAILY;COUNT=0",
+    "FREQ=DAILY;INTERVAL=0",
+    "FREQ=WEEKLY;BYDAY=XX",
+    "FREQ=DAILY;BYMONTH=1",
+])
+def test_invalid_rules_are_rejected(raw):
+    with pytest.raises(ValueError):
+        app._parse_rrule(raw)
+
+
+# --- /activities con recurrentes ---
+
+@pytest.fixture
+def habit(client, auth):
+    """Hábito diario empezado hace 10 días, con anteayer y ayer completados."""
+    today = date.today()
+    r = client.post("/activities", headers=auth, json={
+        "title": "Leer 20 minutos", "due_date": str(today - timedelta(days=10)), "rrule": "FREQ=DAILY",
+    })
+    assert r.status_code == 201, r.text
+    aid = r.json()["id"]
+    for k in (2, 1):
+        r = client.post(f"/activities/{aid}/complete", headers=auth,
+                        params={"occurrence_date": str(today - timedelta(days=k))})
+        assert r.status_code == 200, r.text
+    return aid
+
+
+def _list(client, auth, **params):
+    r = client.get("/activities", headers=auth, params={"limit": 1000, **params})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def _occurrences(items):
+    return sorted(date.fromisoformat(x["occurrence_date"]) for x in items)
+
+
+def test_default_pending_is_next_occurrence_only(client, auth, habit):
+    today = date.today()
+    items = _list(client, auth, status="pending")
+    assert [x["id"] for x in items] == [habit]
+    assert _occurrences(items) == [today]
+
+    client.post(f"/activities/{habit}/complete", headers=auth)
+    assert _occurrences(_list(client, auth, status="pending")) == [today + timedelta(days=1)]
+
+
+def test_default_done_looks_backwards(client, auth, habit):
+    today = date.today()
+    items = _list(client, auth, status="done")
+    assert all(x["is_done"] for x in items)
+    assert _occurrences(items) == [today - timedelta(days=2), today - timedelta(days=1)]
+
+
+def test_default_all_is_history_plus_next(client, auth, habit):
+    today = date.today()
+    assert _occurrences(_list(client, auth)) == [today - timedelta(days=2), today - timedelta(days=1), today]
+
+
+def test_overdue_and_today(client, auth, habit):
+    today = date.today()
+    overdue = _occurrences(_list(client, auth, date="overdue"))
+    assert overdue == [today - timedelta(days=k) for k in range(10, 2, -1)]
+    assert _occurrences(_list(client, auth, date="today")) == [today]
+
+
+def test_explicit_window_is_capped(client, auth, habit):
+    today = date.today()
+    items = _list(client, auth, due_from=str(today), due_to=str(today + timedelta(days=5000)))
+    assert len(items) == app.RECURRENCE_MAX_WINDOW_DAYS + 1
+    assert _occurrences(items)[-1] == today + timedelta(days=app.RECURRENCE_MAX_WINDOW_DAYS)
+
+
+@pytest.mark.parametrize("params", [
+    {"due_from": "9999-12-31"},
+    {"due_to": "0001-01-05"},
+    {"due_from": "0001-01-01"},
+    {"due_to": "9999-12-31"},
+    {"due_from": "0001-01-01", "due_to": "9999-12-31"},
+])
+def test_extreme_windows_do_not_fail(client, auth, habit, params):
+    _list(client, auth, **params)
+
+
+def test_extreme_dtstart(client, auth):
+    for rrule in ("FREQ=DAILY", "FREQ=MONTHLY", "FREQ=WEEKLY;BYDAY=MO,SU"):
+        for due in ("0001-01-01", "9999-12-25"):
+            r = client.post("/activities", headers=auth, json={"title": "x", "due_date": due, "rrule": rrule})
+            assert r.status_code == 201, r.text
+    _list(client, auth)
+    items = _list(client, auth, due_from="9999-12-01")
+    assert {x["occurrence_date"] for x in items} >= {"9999-12-25", "9999-12-31"}
+
+
+def test_complete_checks_occurrence(client, auth):
+    r = client.post("/activities", headers=auth, json={
+        "title": "Museo", "due_date": "2024-01-01", "rrule": "FREQ=WEEKLY", "points_on_complete": 7,
+    })
+    aid = r.json()["id"]
+    r = client.post(f"/activities/{aid}/complete", headers=auth, params={"occurrence_date": "2024-01-02"})
+    assert r.status_code == 400
+    r = client.post(f"/activities/{aid}/complete", headers=auth, params={"occurrence_date": "2024-01-08"})
+    assert r.json()["awarded_points"] == 7
+    r = client.post(f"/activities/{aid}/complete", headers=auth, params={"occurrence_date": "2024-01-08"})
+    assert r.json()["is_done"] and r.json()["awarded_points"] == 0
@@ -0,0 +1,107 @@
+# test_users.py
+# Búsquedas de identidad sin distinguir mayúsculas (columnas *_norm), su migración y /users/available.
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+import app
+
+
+def _signup(client, username, email, password="12345678"):
+    return client.post("/users", json={"email": email, "username": username, "password": password})
+
+
+@pytest.fixture
+def alice(client):
+    tag = uuid4().hex[:8]
+    name, email = f"Alice.{tag}", f"Alice.{tag}@Example.com"
+    r = _signup(client, name, email)
+    assert r.status_code == 201, r.text
+    return r.json()
+
+
+def test_norm_columns_follow_writes(client, alice):
+    with app.SessionLocal() as db:
+        u = db.get(app.UserORM, alice["id"])
+        assert (u.username_norm, u.email_norm) == (alice["username"].lower(), alice["email"].lower())
+    new = "Renamed." + alice["id"][:8]
+    assert client.patch(f"/users/{alice['id']}", json={"username": new}).status_code == 200
+    with app.SessionLocal() as db:
+        assert db.get(app.UserORM, alice["id"]).username_norm == new.lower()
+
+
+def test_login_ignores_case(client, alice):
+    for login in (alice["username"].upper(), alice["username"].lower(), alice["email"].upper()):
+        r = client.post("/auth/login", json={"username": login, "password": "12345678"})
+        assert r.status_code == 200, login
+        assert r.json()["user"]["id"] == alice["id"]
+    assert client.post("/auth/login", json={"username": alice["username"], "password": "wrong-pass"}).status_code == 401
+
+
+def test_duplicates_differing_only_in_case_are_rejected(client, alice):
+    r = _signup(client, alice["username"].upper(), f"other{uuid4().hex[:8]}@example.com")
+    assert r.status_code == 409 and "Username" in r.json()["detail"]
+    r = _signup(client, "u" + uuid4().hex[:8], alice["email"].upper())
+    assert r.status_code == 409 and "Email" in r.json()["detail"]
+
+
+def test_friend_request_by_username_ignores_case(client, auth, alice):
+    r = client.post("/friends/request", headers=auth, json={"to_username": alice["username"].upper()})
+    assert r.status_code == 201, r.text
+    assert alice["id"] in (r.json()["user_a_id"], r.json()["user_b_id"])
+
+
+def test_username_available(client, alice):
+    def available(name):
+        r = client.get("/users/available", params={"username": name})
+        assert r.status_code == 200
+        return r.json()["available"]
+
+    assert available(alice["username"]) is False
+    assert available(alice["username"].swapcase()) is False
+    fresh = "new." + uuid4().hex[:8]
+    assert available(fresh) is True
+    assert _signup(client, fresh, f"{fresh}@example.com").status_code == 201
+    assert available(fresh.upper()) is False
+    assert client.get("/users/available", params={"username": "a b"}).status_code == 422
+
+
+def test_available_uses_the_unique_index():
+    with app.engine.connect() as conn:
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM users WHERE username_norm = 'x'"
+        )).all()
+    assert any("ix_users_username_norm" in str(row) for row in plan)
+
+
+def test_migration_adds_and_backfills_norm_columns(tmp_path, monkeypatch):
+    # esquema de users anterior a email_norm/username_norm, con datos
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE users (id VARCHAR(36) PRIMARY KEY, email VARCHAR(255) NOT NULL UNIQUE, "
+            "username VARCHAR(30) NOT NULL UNIQUE, full_name VARCHAR(255), is_active BOOLEAN NOT NULL, "
+            "created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, password_hash VARCHAR(255))"
+        ))
+        conn.execute(text(
+            "INSERT INTO users (id, email, username, is_active) VALUES "
+            "('1', ' Bob@Example.COM', 'Bob', 1), ('2', 'carol@example.com', 'CaRoL', 1)"
+        ))
+    monkeypatch.setattr(app, "engine", engine)
+    monkeypatch.setattr(app, "_ADDED_COLUMNS", {"users": app._ADDED_COLUMNS["users"]})
+
+    app._add_missing_columns()
+    app._add_missing_columns()  # idempotente: la segunda vez no hay nada que añadir
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, email_norm, username_norm FROM users ORDER BY id")).all()
+        assert [tuple(r) for r in rows] == [("1", "bob@example.com", "bob"), ("2", "carol@example.com", "carol")]
+        unique = {ix["name"] for ix in inspect(conn).get_indexes("users") if ix["unique"]}
+        assert {"ix_users_email_norm", "ix_users_username_norm"} <= unique
+        with pytest.raises(IntegrityError):
+            conn.execute(text(
+                "INSERT INTO users (id, email, username, is_active, email_norm, username_norm) "
+                "VALUES ('3', 'x@example.com', 'BOB', 1, 'x@example.com', 'bob')"
+            ))
@@ -0,0 +1,19 @@
+# worker.py
+# Drena el outbox en un proceso aparte (escalado horizontal).
+# Uso: OUTBOX_INPROCESS=0 en la API y `python worker.py` en tantos procesos como haga falta.
+import asyncio
+import signal
+
+from app import run_outbox_worker
+
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await run_outbox_worker(stop)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
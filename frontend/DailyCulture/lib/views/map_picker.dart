@@ -1,9 +1,12 @@
 // lib/widgets/map_picker.dart
 import 'dart:async';
 import 'dart:convert';
+import 'dart:io' show Platform;
 
+import 'package:flutter/foundation.dart' show kIsWeb;
 import 'package:flutter/material.dart';
 import 'package:flutter_map/flutter_map.dart';
+import 'package:flutter_secure_storage/flutter_secure_storage.dart';
 import 'package:http/http.dart' as http;
 import 'package:latlong2/latlong.dart';
 
@@ -47,8 +50,37 @@ class _MapPickerPageState extends State<MapPickerPage> {
   // Debounce para reverse geocoding
   Timer? _revDebounce;
 
-  // Nominatim requiere un User-Agent identificable
-  static const _ua = 'DailyCulture/1.0 (contact: example@example.com)';
+  // /geo/* exige sesión: mismo token que el resto de vistas
+  final _storage = const FlutterSecureStorage();
+  String? _token;
+  NetworkTileProvider? _tileProvider; // se crea al tener el token (las teselas llevan la cabecera)
+
+  // ==== BASE URL (igual estilo que otras vistas) ====
+  // Búsqueda, reverse y teselas pasan por el backend (/geo/*), que cachea y
+  // pone el User-Agent que exige la política de uso de OpenStreetMap.
+  static const String _apiBaseOverride =
+  String.fromEnvironment('API_BASE', defaultValue: '');
+  String get _apiBase {
+    final base = () {
+      if (_apiBaseOverride.isNotEmpty) return _apiBaseOverride;
+      if (kIsWeb) return 'http://127.0.0.1:8000';
+      try {
+        if (Platform.isAndroid) return 'http://10.0.2.2:8000';
+      } catch (_) {}
+      return 'http://127.0.0.1:8000';
+    }();
+    return base.endsWith('/') ? base.substring(0, base.length - 1) : base;
+  }
+
+  Uri _apiUri(String path, [Map<String, String>? q]) {
+    final p = path.startsWith('/') ? path : '/$path';
+    return Uri.parse('$_apiBase$p').replace(queryParameters: q);
+  }
+
+  Map<String, String> _headers() => {
+    'Accept': 'application/json',
+    if (_token != null) 'Authorization': 'Bearer $_token',
+  };
 
   @override
   void initState() {
@@ -58,6 +90,18 @@ class _MapPickerPageState extends State<MapPickerPage> {
     _center = widget.initialCenter ?? LatLng(40.4168, -3.7038);
     _zoom = widget.initialZoom;
 
+    _init();
+  }
+
+  Future<void> _init() async {
+    _token = await _storage.read(key: 'access_token');
+    if (!mounted) return;
+    setState(() {
+      _tileProvider = NetworkTileProvider(headers: {
+        if (_token != null) 'Authorization': 'Bearer $_token',
+      });
+    });
+
     if (widget.initialQuery != null && widget.initialQuery!.isNotEmpty) {
       _searchCtrl.text = widget.initialQuery!;
       // Lanzamos una búsqueda inicial
@@ -80,12 +124,13 @@ class _MapPickerPageState extends State<MapPickerPage> {
   Future<void> _geocodeAndGo(String query) async {
     if (query.trim().isEmpty) return;
     try {
-      final uri = Uri.parse(
-        'https://nominatim.openstreetmap.org/search'
-            '?q=${Uri.encodeQueryComponent(query)}'
-            '&format=json&limit=1&addressdetails=1&accept-language=es',
-      );
-      final res = await http.get(uri, headers: {'User-Agent': _ua});
+      final uri = _apiUri('/geo/search', {
+        'q': query,
+        'limit': '1',
+        'addressdetails': '1',
+        'accept-language': 'es',
+      });
+      final res = await http.get(uri, headers: _headers());
       if (res.statusCode != 200) return;
       final list = jsonDecode(res.body) as List<dynamic>;
       if (list.isEmpty) return;
@@ -108,12 +153,13 @@ class _MapPickerPageState extends State<MapPickerPage> {
 
   Future<void> _reverseGeocode(LatLng p) async {
     try {
-      final uri = Uri.parse(
-        'https://nominatim.openstreetmap.org/reverse'
-            '?lat=${p.latitude}&lon=${p.longitude}'
-            '&format=json&zoom=18&accept-language=es',
-      );
-      final res = await http.get(uri, headers: {'User-Agent': _ua});
+      final uri = _apiUri('/geo/reverse', {
+        'lat': '${p.latitude}',
+        'lon': '${p.longitude}',
+        'zoom': '18',
+        'accept-language': 'es',
+      });
+      final res = await http.get(uri, headers: _headers());
       if (res.statusCode != 200) return;
       final m = jsonDecode(res.body) as Map<String, dynamic>;
       setState(() {
@@ -171,10 +217,12 @@ class _MapPickerPageState extends State<MapPickerPage> {
             ),
             // 👇 sin 'const' porque TileLayer no es const
             children: [
-              TileLayer(
-                urlTemplate: 'https://tile.openstreetmap.org/{z}/{x}/{y}.png',
-                userAgentPackageName: 'com.example.dailyculture',
-              ),
+              if (_tileProvider != null)
+                TileLayer(
+                  urlTemplate: '$_apiBase/geo/tiles/{z}/{x}/{y}',
+                  userAgentPackageName: 'com.example.dailyculture',
+                  tileProvider: _tileProvider,
+                ),
             ],
           ),
 
@@ -55,6 +55,7 @@ class _ActivitiesViewState extends State<ActivitiesView>
   static const _kCacheToday = 'activities_cache_today';
   static const _kCacheDone = 'activities_cache_done';
   static const _kCacheMyPoints = 'my_points_local';
+  static const _kCachePendingPoints = 'my_points_pending';
 
   // Prefijo por usuario (evita contaminación entre sesiones)
   String _userScope = 'anon';
@@ -74,8 +75,11 @@ class _ActivitiesViewState extends State<ActivitiesView>
   List<Activity> _open = [];
   List<Activity> _done = [];
 
-  // Mis puntos (local, persistente)
+  // Mis puntos (local, persistente): último total del servidor + puntos concedidos
+  // que el worker aún no ha sumado. Se muestran juntos; /points/me reconcilia ambos.
   int _myPoints = 0;
+  int _pendingPoints = 0;
+  int get _shownPoints => _myPoints + _pendingPoints;
 
   // Creación (bottom sheet)
   final _titleCtrl = TextEditingController();
@@ -143,20 +147,28 @@ class _ActivitiesViewState extends State<ActivitiesView>
   Future<void> _loadMyPoints() async {
     try {
       final s = await _storage.read(key: _ns(_kCacheMyPoints));
+      final p = await _storage.read(key: _ns(_kCachePendingPoints));
       _myPoints = int.tryParse(s ?? '0') ?? 0;
+      _pendingPoints = int.tryParse(p ?? '0') ?? 0;
     } catch (_) {
       _myPoints = 0;
+      _pendingPoints = 0;
     }
   }
 
-  Future<void> _setMyPoints(int v) async {
-    _myPoints = v < 0 ? 0 : v;
+  /// Guarda el total del servidor y lo pendiente. Se sustituye tal cual (sin quedarse
+  /// con el máximo): si un canje resta puntos o una concesión falla, se ve.
+  Future<void> _setMyPoints(int total, {required int pending}) async {
+    _myPoints = total < 0 ? 0 : total;
+    _pendingPoints = pending < 0 ? 0 : pending;
     await _storage.write(key: _ns(_kCacheMyPoints), value: '$_myPoints');
+    await _storage.write(key: _ns(_kCachePendingPoints), value: '$_pendingPoints');
   }
 
+  /// Puntos recién concedidos por /complete: pendientes hasta el próximo /points/me.
   Future<void> _addPoints(int delta) async {
     if (delta <= 0) return;
-    await _setMyPoints(_myPoints + delta);
+    await _setMyPoints(_myPoints, pending: _pendingPoints + delta);
   }
 
   /* ====================== CACHE ====================== */
@@ -388,11 +400,15 @@ class _ActivitiesViewState extends State<ActivitiesView>
         return;
       }
 
-      // El backend devuelve ActivityOut actualizado
-      final updated =
-      Activity.fromJson(Map<String, dynamic>.from(jsonDecode(res.body)));
+      // El backend devuelve ActivityOut actualizado (+ awarded_points)
+      final m = Map<String, dynamic>.from(jsonDecode(res.body));
+      final updated = Activity.fromJson(m);
 
-      final awarded = a.pointsOnComplete ?? 0; // server no envía awarded_points
+      // Los puntos se suman en segundo plano: usamos lo que el server dice haber concedido
+      final rawAwarded = m['awarded_points'];
+      final awarded = (rawAwarded is num)
+          ? rawAwarded.toInt()
+          : (a.pointsOnComplete ?? 0);
       await _addPoints(awarded);
       _snack('Actividad completada 🎉 +$awarded pts');
 
@@ -416,7 +432,9 @@ class _ActivitiesViewState extends State<ActivitiesView>
   }
 
   /// Intenta pedir tu total de puntos y mostrarlo en un snack.
-  /// Si responde, sincroniza el contador local.
+  /// Si responde, sincroniza el contador local. El backend suma los puntos en
+  /// segundo plano: `total` es lo ya sumado y `pending` lo que sigue en cola, así que
+  /// los pendientes locales se sustituyen por los del servidor.
   Future<void> _showMyTotalPoints() async {
     try {
       final uri = _apiUri('/points/me');
@@ -429,8 +447,11 @@ class _ActivitiesViewState extends State<ActivitiesView>
           final t =
           (total is num) ? total.toInt() : int.tryParse(total.toString());
           if (t != null) {
-            await _setMyPoints(t);
-            _snack('Total: $t pts');
+            final p = m['pending'];
+            await _setMyPoints(t, pending: (p is num) ? p.toInt() : 0);
+            _snack(_pendingPoints > 0
+                ? 'Total: $_shownPoints pts ($_pendingPoints pendientes)'
+                : 'Total: $_shownPoints pts');
           }
         }
       }